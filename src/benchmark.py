@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import resource
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime
+
+# End-to-end benchmark of the update and backfill paths, against fixtures replayed by stub-server.py
+# and a throwaway Postgres. Each stage runs in its own process so peak RSS is its own.
+# e.g. python record-fixtures.py --week 2024-01-15 --season 20232024 --gamelogs --max-players 50
+#      python benchmark.py --week 2024-01-15 --start-season 2023 --end-season 2024
+#      python benchmark.py --compare data/benchmarks/before.json data/benchmarks/after.json
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ('schema', 'players', 'games', 'gamelogs', 'season-games', 'weekly')
+ROW_TABLES = ('players', 'goalers', 'games', 'gamelogs', 'goalerGameLogs')
+METRICS = ('wallSeconds', 'apiCalls', 'apiRetries', 'sqlStatements', 'rowsAdded', 'rowsPerSecond', 'peakRssMb')
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+# Tables a stage must add rows to on a fresh database, or it did not do its work
+EXPECTED_ROWS = {
+    'players': ('players', 'goalers'),
+    'games': ('games',),
+    'gamelogs': ('gamelogs', 'goalerGameLogs'),
+}
+DATABASE_USER = 'py-user'
+DATABASE_NAME = 'nhl-stats-fetcher'
+
+
+def load_script(name):
+    # init-db.py and update-games-stats.py can't be imported by name
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(SCRIPTS_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_rows():
+    from controllers.db import unit_of_work
+    counts = {}
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            for table in ROW_TABLES:
+                cur.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+                if cur.fetchone()[0]:
+                    cur.execute('SELECT count(*) FROM ' + table)
+                    counts[table] = cur.fetchone()[0]
+                else:
+                    counts[table] = 0
+    return counts
+
+
+def run_stage(stage, args):
+    # Runs in the child process, prints one result line for the parent.
+    from controllers.api import governor
+    from controllers.db import statement_count
+    from controllers.game import get_season_games
+    from controllers.metrics import metrics
+    initDb = load_script('init-db')
+    updates = load_script('update-games-stats')
+
+    stages = {
+        'schema': lambda: (initDb.generate_db(), initDb.migrate(), initDb.insertTeams(), initDb.initPools()),
+        'players': lambda: (initDb.insertPlayers(args.start_season, args.end_season), initDb.insertGoalers(args.start_season, args.end_season)),
+        'games': lambda: initDb.insertGames(args.start_season, args.end_season, args.workers),
+        'gamelogs': lambda: (initDb.insertGameLogs(args.start_season, args.end_season, args.workers), initDb.insertGoalerGameLogs(args.start_season, args.end_season, args.workers)),
+        'season-games': lambda: get_season_games(str(args.end_season - 1) + str(args.end_season)),
+        'weekly': lambda: updates.updateWeeklyStats(datetime.strptime(args.week, '%Y-%m-%d')),
+    }
+
+    rowsBefore = count_rows()
+    statementsBefore = statement_count()
+    requestsBefore = governor.stats['requests']
+    retriesBefore = governor.stats['retries']
+
+    start = time.perf_counter()
+    output = stages[stage]()
+    wallSeconds = time.perf_counter() - start
+
+    statements = statement_count() - statementsBefore
+    rowsAfter = count_rows()
+    rowsAdded = sum(rowsAfter[table] - rowsBefore[table] for table in ROW_TABLES)
+
+    # The save paths swallow their errors, so check the stage actually did its work
+    failures = [str(count) + ' ' + name + ' errors' for name, count in sorted(metrics.errors.items())]
+    for table in EXPECTED_ROWS.get(stage, ()):
+        if rowsAfter[table] == rowsBefore[table]:
+            failures.append('no rows added to ' + table)
+    if stage == 'season-games' and len(output) == 0:
+        failures.append('no games in season')
+    if stage == 'weekly' and 'parse' not in metrics.stages:
+        failures.append('no game parsed')
+    result = {
+        'stage': stage,
+        'wallSeconds': round(wallSeconds, 3),
+        'apiCalls': governor.stats['requests'] - requestsBefore,
+        'apiRetries': governor.stats['retries'] - retriesBefore,
+        'sqlStatements': statements,
+        'rowsAdded': rowsAdded,
+        'rowsPerSecond': round(rowsAdded / wallSeconds, 1) if wallSeconds > 0 else 0,
+        # ru_maxrss is in kilobytes on Linux
+        'peakRssMb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rows': {table: rowsAfter[table] - rowsBefore[table] for table in ROW_TABLES},
+        'failures': failures,
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout = 10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Nothing listening on port ' + str(port))
+
+
+class LocalPostgres:
+    # A cluster in a temp directory, trusted local connections only, removed on stop().
+    def __init__(self, binDir):
+        self.initdb = self.binary('initdb', binDir)
+        self.pgCtl = self.binary('pg_ctl', binDir)
+        self.directory = tempfile.mkdtemp(prefix='nhl-bench-pg-')
+        self.port = free_port()
+
+    def binary(self, name, binDir):
+        path = shutil.which(name, path=binDir) if binDir else shutil.which(name)
+        if path is None:
+            raise RuntimeError(name + ' not found, pass --pg-bin or --pg-host')
+        return path
+
+    def start(self):
+        dataDir = os.path.join(self.directory, 'data')
+        subprocess.run([self.initdb, '-D', dataDir, '-U', DATABASE_USER, '-A', 'trust'], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            self.pgCtl, '-D', dataDir, '-l', os.path.join(self.directory, 'postgres.log'), '-w',
+            '-o', '-p ' + str(self.port) + ' -k ' + self.directory + ' -c listen_addresses=127.0.0.1 -c fsync=off',
+            'start',
+        ], check=True, stdout=subprocess.DEVNULL)
+        create_database('127.0.0.1', self.port, DATABASE_USER, None, DATABASE_NAME)
+        return {'DATABASE_URL': '127.0.0.1', 'DATABASE_PORT': str(self.port), 'DATABASE_USERNAME': DATABASE_USER, 'DATABASE_PASSWORD': '', 'DATABASE_NAME': DATABASE_NAME}
+
+    def stop(self):
+        subprocess.run([self.pgCtl, '-D', os.path.join(self.directory, 'data'), '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def create_database(host, port, user, password, name):
+    import psycopg2
+    conn = psycopg2.connect(dbname='postgres', host=host, port=port, user=user, password=password)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('DROP DATABASE IF EXISTS "' + name + '"')
+        cur.execute('CREATE DATABASE "' + name + '"')
+    conn.close()
+
+
+def drop_database(host, port, user, password, name):
+    import psycopg2
+    conn = psycopg2.connect(dbname='postgres', host=host, port=port, user=user, password=password)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('DROP DATABASE IF EXISTS "' + name + '"')
+    conn.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def stub_stats(replayUrl):
+    import httpx
+    return httpx.get(replayUrl + '/__stats').json()
+
+
+def run_benchmark(args):
+    workDir = tempfile.mkdtemp(prefix='nhl-bench-')
+    env = dict(os.environ)
+    env.update({
+        'HTTP_CACHE_DIR': '',
+        'SEASON_CACHE_PATH': os.path.join(workDir, 'seasons.json'),
+        'API_RATE_LIMIT': str(args.api_rate),
+    })
+
+    stubPort = free_port()
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(SCRIPTS_DIR, 'stub-server.py'), '--fixtures', args.fixtures, '--port', str(stubPort),
+        '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+    ], stdout=subprocess.DEVNULL)
+    env['API_REPLAY_URL'] = 'http://127.0.0.1:' + str(stubPort)
+
+    postgres = None
+    databaseName = None
+    try:
+        wait_for_port(stubPort)
+        if args.pg_host:
+            databaseName = 'nhl_bench_' + str(os.getpid())
+            create_database(args.pg_host, args.pg_port, args.pg_user, args.pg_password, databaseName)
+            env.update({'DATABASE_URL': args.pg_host, 'DATABASE_PORT': str(args.pg_port), 'DATABASE_USERNAME': args.pg_user, 'DATABASE_PASSWORD': args.pg_password or '', 'DATABASE_NAME': databaseName})
+        else:
+            postgres = LocalPostgres(args.pg_bin)
+            env.update(postgres.start())
+
+        results = []
+        for stage in args.stages:
+            print('Running ' + stage)
+            missingBefore = stub_stats(env['API_REPLAY_URL']).get('missing', 0)
+            command = [sys.executable, os.path.abspath(__file__), '--run-stage', stage, '--week', args.week,
+                       '--start-season', str(args.start_season), '--end-season', str(args.end_season), '--workers', str(args.workers)]
+            child = subprocess.run(command, cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True)
+            result = None
+            for line in child.stdout.splitlines():
+                if line.startswith(RESULT_PREFIX):
+                    result = json.loads(line[len(RESULT_PREFIX):])
+                elif args.verbose:
+                    print('  ' + line)
+            if result is None:
+                print(child.stdout[-2000:])
+                print(child.stderr[-2000:])
+                raise RuntimeError('Stage ' + stage + ' failed')
+            missing = stub_stats(env['API_REPLAY_URL']).get('missing', 0) - missingBefore
+            if missing > 0:
+                result['failures'].append(str(missing) + ' requests without a fixture')
+            if result['failures']:
+                # Timings of work that never ran would look valid, so nothing gets saved
+                raise RuntimeError('Stage ' + stage + ' did not run fully: ' + ', '.join(result['failures']) + '. Record the missing fixtures with record-fixtures.py')
+            results.append(result)
+            print('  ' + ', '.join(metric + ': ' + str(result[metric]) for metric in METRICS))
+
+        stubStats = stub_stats(env['API_REPLAY_URL'])
+    finally:
+        stub.terminate()
+        stub.wait()
+        if postgres is not None:
+            postgres.stop()
+        if databaseName is not None:
+            drop_database(args.pg_host, args.pg_port, args.pg_user, args.pg_password, databaseName)
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        'startedAt': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'settings': {
+            'week': args.week,
+            'startSeason': args.start_season,
+            'endSeason': args.end_season,
+            'workers': args.workers,
+            'apiRate': args.api_rate,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'errorRate': args.error_rate,
+            'throttleRate': args.throttle_rate,
+        },
+        'stages': results,
+        'stubServer': stubStats,
+    }
+    output = args.output or os.path.join('./data/benchmarks', datetime.now().strftime('%Y%m%d-%H%M%S') + '-' + commit + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Saved ' + output)
+
+
+def compare(beforePath, afterPath):
+    with open(beforePath, 'r') as f:
+        before = json.load(f)
+    with open(afterPath, 'r') as f:
+        after = json.load(f)
+    print(before['commit'] + ' -> ' + after['commit'])
+    beforeStages = {result['stage']: result for result in before['stages']}
+    for result in after['stages']:
+        previous = beforeStages.get(result['stage'])
+        if previous is None:
+            continue
+        print(result['stage'])
+        for metric in METRICS:
+            old, new = previous[metric], result[metric]
+            change = ' (' + ('%+.1f' % ((new - old) * 100.0 / old)) + '%)' if old else ''
+            print('  ' + metric + ': ' + str(old) + ' -> ' + str(new) + change)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stages', nargs='*', default=list(STAGES), help=', '.join(STAGES))
+    parser.add_argument('--week', default='2024-01-15', help='first day of the week updateWeeklyStats runs on')
+    parser.add_argument('--start-season', type=int, default=2023)
+    parser.add_argument('--end-season', type=int, default=2024)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--fixtures', default=os.path.abspath('./data/fixtures'))
+    parser.add_argument('--api-rate', type=float, default=0, help='requests per second, 0 for no limit')
+    parser.add_argument('--latency', type=float, default=0, help='stub server mean latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--pg-bin', help='directory of initdb and pg_ctl, PATH by default')
+    parser.add_argument('--pg-host', help='use a temporary database on this server instead of a local cluster')
+    parser.add_argument('--pg-port', type=int, default=5432)
+    parser.add_argument('--pg-user', default='postgres')
+    parser.add_argument('--pg-password')
+    parser.add_argument('--output', help='result file, data/benchmarks/<time>-<commit>.json by default')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.run_stage:
+        run_stage(args.run_stage, args)
+    else:
+        for stage in args.stages:
+            if stage not in STAGES:
+                parser.error('unknown stage ' + stage)
+        args.fixtures = os.path.abspath(args.fixtures)
+        run_benchmark(args)
@@ -0,0 +1,77 @@
+import numpy as np
+from controllers.pool import Pool, POOL_COLUMNS
+from controllers.scoring import SKATER_CATEGORIES, GOALIE_CATEGORIES, FORWARD, DEFENSE, GOALIE, GameLogArrays, game_numbers, score_pools
+
+# Checks the scoring engine on a few hand made gamelogs, no database or API needed.
+# e.g. python check-scoring.py
+
+
+def check(name, ok):
+    print(('ok     ' if ok else 'FAILED ') + name)
+    return ok
+
+
+def skater_log(gameId, playerId, gameDate, group, goals = 0, assists = 0):
+    return (gameId, playerId, gameDate, group, goals, assists, 0, 0, 0, 0)
+
+
+def goalie_log(gameId, playerId, gameDate, wins = 0):
+    return (gameId, playerId, gameDate, GOALIE, wins, 0, 0, 0, 0)
+
+
+def pool(poolId, season, **values):
+    values.setdefault('scoringGoals', 1)
+    values.setdefault('scoringAssists', 1)
+    values.setdefault('scoringGoalieWins', 2)
+    return Pool(poolId=poolId, season=season, **values)
+
+
+def run_checks():
+    results = []
+
+    numbers = game_numbers(
+        np.array([8, 8, 8, 9, 8], dtype=np.int64),
+        np.array([20232024, 20232024, 20232024, 20232024, 20242025], dtype=np.int64),
+        np.array(['2024-01-03', '2024-01-01', '2024-01-01', '2024-01-02', '2024-10-10'], dtype='datetime64[D]'),
+        np.array([2023020030, 2023020020, 2023020010, 2023020025, 2024020001], dtype=np.int64),
+    )
+    results.append(check('game numbers follow date then game id, per player and season', numbers.tolist() == [3, 2, 1, 1, 1]))
+
+    skaters = GameLogArrays([
+        skater_log(2023020001, 8, '2023-10-10', FORWARD, goals=1),
+        skater_log(2023020002, 8, '2023-10-12', FORWARD, goals=1),
+        skater_log(2023020003, 8, '2023-10-14', FORWARD, goals=1),
+        skater_log(2023020001, 9, '2023-10-10', DEFENSE, assists=2),
+        skater_log(2024020001, 8, '2024-10-10', FORWARD, goals=5),
+    ], len(SKATER_CATEGORIES))
+    goalies = GameLogArrays([
+        goalie_log(2023020001, 30, '2023-10-10', wins=1),
+        goalie_log(2023020002, 30, '2023-10-12', wins=1),
+    ], len(GOALIE_CATEGORIES))
+    pools = [
+        # 2 forward games for 2 forwards: 1 game each
+        pool('capped', '20232024', forwards=2, forwardGamePlayed=2, defense=2, defenseGamePlayed=0, goalie=1, goalieGamePlayed=1),
+        pool('uncapped', '20232024', forwards=2, forwardGamePlayed=0),
+        pool('next', '20242025', scoringGoals=3),
+    ]
+    scores = score_pools(pools, skaters, goalies)
+
+    playerIds, totals = scores.skater_totals()
+    totals = dict(zip(playerIds.tolist(), totals.tolist()))
+    results.append(check('forward cap keeps the first game only', totals[8][0] == 1))
+    results.append(check('no cap when the games played cap is 0', totals[8][1] == 3))
+    results.append(check('no cap when the group has no games played cap', totals[9][0] == 2))
+    results.append(check('logs only score in the pool of their season', totals[8][2] == 15 and totals[9][2] == 0))
+
+    playerIds, totals = scores.goalie_totals()
+    totals = dict(zip(playerIds.tolist(), totals.tolist()))
+    results.append(check('goalie cap keeps the first game only', totals[30][0] == 2 and totals[30][1] == 4))
+
+    weights = set(column for column in POOL_COLUMNS if column.startswith('scoring'))
+    scored = set(weight for _, weight, _ in SKATER_CATEGORIES + GOALIE_CATEGORIES)
+    results.append(check('every pool weight belongs to one category', weights == scored and len(scored) == len(SKATER_CATEGORIES) + len(GOALIE_CATEGORIES)))
+    return all(results)
+
+
+if __name__ == '__main__':
+    raise SystemExit(0 if run_checks() else 1)
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import time
+import httpx
+import atexit
+import hashlib
+import threading
+from urllib.parse import urlencode
+from nhlpy import NHLClient
+from nhlpy.http_client import HttpClient
+from controllers.governor import RequestGovernor
+from controllers.replay import FixtureStore, replay_url
+
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", "./data/http-cache")
+HTTP_CACHE_MAX_MB = int(os.environ.get("HTTP_CACHE_MAX_MB", "500"))
+# Seconds before a request to the NHL API gives up
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", "10"))
+# Connections kept open to the NHL hosts, shared by every thread
+API_MAX_CONNECTIONS = int(os.environ.get("API_MAX_CONNECTIONS", "20"))
+# HTTP/2 needs the h2 package (pip install httpx[http2])
+API_HTTP2 = os.environ.get("API_HTTP2", "0") == "1"
+# Base url of a stub-server.py to send every request to instead of the NHL hosts, e.g. http://127.0.0.1:8765
+API_REPLAY_URL = os.environ.get("API_REPLAY_URL", "")
+# Directory to record every JSON response in as a replay fixture
+API_RECORD_DIR = os.environ.get("API_RECORD_DIR", "")
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Game states after which a boxscore or landing never changes again.
+FINAL_GAME_STATES = ('OFF', 'FINAL')
+# Game states while the puck is in play
+LIVE_GAME_STATES = ('LIVE', 'CRIT')
+
+
+def ttl_for(url, body):
+    # Seconds a response stays fresh, None to keep it forever.
+    if re.search(r'/gamecenter/\d+/(boxscore|landing)', url):
+        if body.get('gameState') in FINAL_GAME_STATES:
+            return None
+        # Short enough for live polling to see every change
+        return 5 if body.get('gameState') in LIVE_GAME_STATES else MINUTE
+    if re.search(r'/(schedule|club-schedule|club-schedule-season|schedule-calendar)/', url):
+        return 10 * MINUTE
+    if re.search(r'/player/\d+/landing', url):
+        return DAY
+    return HOUR
+
+
+class ResponseCache:
+    # JSON responses stored on disk under the hash of their request URL,
+    # evicted least recently used first once the directory grows past maxBytes.
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def key(self, url, params=None):
+        if params:
+            url = url + '?' + urlencode(sorted(params.items()))
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expiresAt'] is not None and entry['expiresAt'] < time.time():
+            return None
+        # Access time drives the LRU eviction
+        os.utime(path)
+        return entry
+
+    def store(self, key, url, body, ttl):
+        path = self.path(key)
+        entry = {
+            'url': url,
+            'fetchedAt': time.time(),
+            'expiresAt': None if ttl is None else time.time() + ttl,
+            'body': body,
+        }
+        tmpPath = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(entry, f)
+        with self.lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmpPath, path)
+            self.size += os.path.getsize(path) - previous
+            if self.size > self.maxBytes:
+                self.evict()
+
+    def evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith('.json')),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        # Free down to 90% so we don't evict on every write
+        for entry in entries:
+            if self.size <= self.maxBytes * 0.9:
+                break
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self.size -= size
+
+
+class CachedResponse:
+    def __init__(self, url, body):
+        self.url = url
+        self.status_code = 200
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class CachedHttpClient(HttpClient):
+    def __init__(self, config, cache: ResponseCache, governor: RequestGovernor) -> None:
+        super().__init__(config)
+        self.cache = cache
+        self.governor = governor
+        self.session = build_session(config)
+        self.recorder = FixtureStore(API_RECORD_DIR) if API_RECORD_DIR else None
+
+    def get(self, resource: str):
+        return self.get_by_url(f"{self._config.api_web_base_url}{self._config.api_web_api_ver}{resource}")
+
+    def get_by_url(self, full_resource: str, query_params: dict = None):
+        response = self.get_cached(full_resource, query_params)
+        if self.recorder is not None and response.status_code == 200:
+            self.recorder.save(full_resource, query_params, response.status_code, response.json())
+        return response
+
+    def get_cached(self, full_resource: str, query_params: dict = None):
+        if self.cache is None:
+            return self.fetch(full_resource, query_params)
+
+        key = self.cache.key(full_resource, query_params)
+        entry = self.cache.load(key)
+        if entry is not None:
+            return CachedResponse(entry['url'], entry['body'])
+
+        response = self.fetch(full_resource, query_params)
+        if response.status_code == 200:
+            body = response.json()
+            self.cache.store(key, str(response.url), body, ttl_for(full_resource, body))
+        return response
+
+    def fetch(self, full_resource: str, query_params: dict = None):
+        # Cache misses only, the governor paces and retries what actually hits the network
+        url = replay_url(full_resource, API_REPLAY_URL) if API_REPLAY_URL else full_resource
+        return self.governor.call(lambda: self.session.get(url=url, params=query_params))
+
+    def close(self):
+        self.session.close()
+
+
+def build_session(config):
+    # One keep-alive connection pool for the whole process instead of a new
+    # httpx.Client, and a new TCP+TLS handshake, per request like nhlpy does.
+    http2 = API_HTTP2
+    if http2:
+        try:
+            import h2
+        except ImportError:
+            print('API_HTTP2 is set but h2 is not installed, using HTTP/1.1')
+            http2 = False
+    return httpx.Client(
+        verify=config.ssl_verify,
+        timeout=config.timeout,
+        follow_redirects=config.follow_redirects,
+        http2=http2,
+        limits=httpx.Limits(max_connections=API_MAX_CONNECTIONS, max_keepalive_connections=API_MAX_CONNECTIONS),
+    )
+
+
+def build_client():
+    # NHLClient whose endpoints all go through one CachedHttpClient.
+    nhlClient = NHLClient(timeout=API_TIMEOUT)
+    cache = ResponseCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB * 1024 * 1024) if HTTP_CACHE_DIR else None
+    httpClient = CachedHttpClient(nhlClient._config, cache, governor)
+    nhlClient._http_client = httpClient
+    for endpoint in (nhlClient.teams, nhlClient.standings, nhlClient.schedule, nhlClient.game_center, nhlClient.stats, nhlClient.misc, nhlClient.playoffs):
+        endpoint.client = httpClient
+    return nhlClient
+
+
+governor = RequestGovernor()
+client = build_client()
+atexit.register(client._http_client.close)
+
+
+def get_url(url, params=None):
+    # Direct calls to NHL endpoints nhlpy doesn't wrap, through the same cache.
+    return client._http_client.get_by_url(url, params)
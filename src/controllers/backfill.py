@@ -0,0 +1,70 @@
+import os
+import psycopg2
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from controllers.db import unit_of_work
+
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "8"))
+
+
+def createCheckpointTable():
+    sql = '''
+        CREATE TABLE IF NOT EXISTS backfillCheckpoints (
+            entity VARCHAR(50),
+            unitKey VARCHAR(255),
+            season VARCHAR(8),
+            gameType INTEGER,
+            rowsWritten INTEGER,
+            doneAt TIMESTAMP,
+            PRIMARY KEY (entity, unitKey, season, gameType)
+        )
+        '''
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+
+
+def get_done_units(entity):
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT unitKey, season, gameType FROM backfillCheckpoints WHERE entity = %s', (entity,))
+            return set(cur.fetchall())
+
+
+def run_backfill(entity, units, fetch, save, workers = BACKFILL_WORKERS):
+    # units are (unitKey, season, gameType) tuples. fetch(unit) runs in the worker pool and returns
+    # the unit's rows, save(conn, rows) runs on this thread in the same transaction as the unit's
+    # checkpoint. Units already checkpointed are skipped, so a crashed backfill resumes where it stopped.
+    try:
+        createCheckpointTable()
+        done = get_done_units(entity)
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        return
+
+    pending = [unit for unit in units if (str(unit[0]), unit[1], unit[2]) not in done]
+    print('Backfilling ' + entity + ': ' + str(len(pending)) + '/' + str(len(units)) + ' units left')
+
+    checkpoint_sql = '''
+        INSERT INTO backfillCheckpoints (entity, unitKey, season, gameType, rowsWritten, doneAt)
+        VALUES (%s, %s, %s, %s, %s, now())
+        ON CONFLICT DO NOTHING
+        '''
+    index = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, unit): unit for unit in pending}
+        for future in as_completed(futures):
+            unit = futures[future]
+            index += 1
+            try:
+                rows = future.result()
+                with unit_of_work() as conn:
+                    save(conn, rows)
+                    with conn.cursor() as cur:
+                        cur.execute(checkpoint_sql, (entity, str(unit[0]), unit[1], unit[2], len(rows)))
+            except (psycopg2.DatabaseError, Exception) as error:
+                print('Cannot backfill ' + entity + ' ' + str(unit))
+                traceback.print_exc()
+
+            if index % 100 == 0 or index == len(pending):
+                print(str(index) + '/' + str(len(pending)) + ' ' + entity + ' units')
@@ -0,0 +1,96 @@
+import os
+import psycopg2
+import traceback
+from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor
+from controllers.api import get_url
+from controllers.db import unit_of_work
+
+BIO_REFRESH_WORKERS = int(os.environ.get("BIO_REFRESH_WORKERS", "8"))
+# Bios fetched less than this many days ago are not fetched again
+BIO_REFRESH_DAYS = int(os.environ.get("BIO_REFRESH_DAYS", "30"))
+
+# players and goalers share the bio columns
+BIO_TABLES = ('players', 'goalers')
+
+
+def age_sql(birthDate = 'birthDate'):
+    # Age in whole years at the time the statement runs
+    return "date_part('year', age(" + birthDate + "))::INTEGER"
+
+
+def get_stale_players(table, maxAgeDays):
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'SELECT playerId FROM ' + table
+                + ' WHERE bioUpdatedAt IS NULL OR bioUpdatedAt < now() - make_interval(days => %s)',
+                (maxAgeDays,)
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+def fetch_bio(playerId):
+    # (playerId, birthDate, height, weight, birthCountry) from the player landing, None when it can't be had.
+    try:
+        response = get_url('https://api-web.nhle.com/v1/player/' + str(playerId) + '/landing')
+    except Exception:
+        print('Cannot get bio of player ' + str(playerId))
+        traceback.print_exc()
+        return None
+    if response.status_code != 200:
+        print('Cannot get bio of player ' + str(playerId) + ', status code ' + str(response.status_code))
+        return None
+    result = response.json()
+    return (playerId, result.get('birthDate'), result.get('heightInInches'), result.get('weightInPounds'), result.get('birthCountry'))
+
+
+def save_bios(table, bios):
+    # One UPDATE for every fetched bio, age is derived from the birth date by the database.
+    if len(bios) == 0:
+        return
+    sql = (
+        'UPDATE ' + table + ' AS p'
+        + ' SET birthDate = v.birthDate, age = ' + age_sql('v.birthDate') + ','
+        + ' height = v.height, weight = v.weight, birthCountry = v.birthCountry, bioUpdatedAt = now()'
+        + ' FROM (VALUES %s) AS v (playerId, birthDate, height, weight, birthCountry)'
+        + ' WHERE p.playerId = v.playerId'
+    )
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, sql, bios, template='(%s::INTEGER, %s::DATE, %s::NUMERIC, %s::NUMERIC, %s::VARCHAR)', page_size=len(bios))
+
+
+def refresh_bios(table, workers = BIO_REFRESH_WORKERS, maxAgeDays = BIO_REFRESH_DAYS):
+    try:
+        playerIds = get_stale_players(table, maxAgeDays)
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        return
+
+    print('Refreshing ' + str(len(playerIds)) + ' ' + table + ' bios')
+    bios = []
+    # The request governor paces the calls, workers only bounds how many are in flight
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, bio in enumerate(executor.map(fetch_bio, playerIds)):
+            if bio is not None:
+                bios.append(bio)
+            if (i + 1) % 100 == 0:
+                print(str(i + 1) + '/' + str(len(playerIds)))
+
+    try:
+        save_bios(table, bios)
+        print('Done. ' + str(len(bios)) + ' bios updated')
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+
+
+def refresh_ages():
+    # Birthdays move ages without any new data to fetch.
+    try:
+        with unit_of_work() as conn:
+            with conn.cursor() as cur:
+                for table in BIO_TABLES:
+                    cur.execute('UPDATE ' + table + ' SET age = ' + age_sql() + ' WHERE birthDate IS NOT NULL AND age IS DISTINCT FROM ' + age_sql())
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
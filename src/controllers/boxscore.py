@@ -0,0 +1,27 @@
+from controllers.game import GameScoringIndex
+from controllers.player import fetch_player_log
+from controllers.goaler import fetch_goaler_log
+
+
+def fetch_game_logs(game, boxScore, landing):
+    gamelogs = []
+    goalerlogs = []
+    scoringIndex = GameScoringIndex(landing["summary"]["scoring"])
+
+    # Away team
+    # Forwards
+    gamelogs += fetch_player_log(boxScore["playerByGameStats"]["awayTeam"]["forwards"], game, scoringIndex, True)
+    # defense
+    gamelogs += fetch_player_log(boxScore["playerByGameStats"]["awayTeam"]["defense"], game, scoringIndex, True)
+    # goalies
+    goalerlogs += fetch_goaler_log(boxScore["playerByGameStats"]["awayTeam"]["goalies"], game, scoringIndex, True)
+    
+    # Home team
+    # Forwards
+    gamelogs += fetch_player_log(boxScore["playerByGameStats"]["homeTeam"]["forwards"], game, scoringIndex, False)
+    # defense
+    gamelogs += fetch_player_log(boxScore["playerByGameStats"]["homeTeam"]["defense"], game, scoringIndex, False)
+    # goalies
+    goalerlogs += fetch_goaler_log(boxScore["playerByGameStats"]["homeTeam"]["goalies"], game, scoringIndex, False)
+
+    return gamelogs, goalerlogs
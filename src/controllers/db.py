@@ -0,0 +1,201 @@
+import io
+import os
+import atexit
+import threading
+from operator import attrgetter
+from collections import namedtuple
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import cursor
+
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "10"))
+
+_pool = None
+_poolLock = threading.Lock()
+# getconn raises instead of waiting when every connection is out, so threads queue here first
+_poolSlots = threading.BoundedSemaphore(DATABASE_POOL_SIZE)
+_local = threading.local()
+_statements = 0
+_statementsLock = threading.Lock()
+
+
+def count_statements(count = 1):
+    global _statements
+    with _statementsLock:
+        _statements += count
+
+
+def statement_count():
+    # Statements sent to the database by this process so far
+    return _statements
+
+
+class CountingCursor(cursor):
+    def execute(self, query, vars=None):
+        count_statements()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        count_statements(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        count_statements()
+        return super().copy_expert(sql, file, size)
+
+
+def get_pool():
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                1,
+                DATABASE_POOL_SIZE,
+                database=os.environ.get("DATABASE_NAME", "nhl-stats-fetcher"),
+                user=os.environ.get("DATABASE_USERNAME", "py-user"),
+                password=os.environ.get("DATABASE_PASSWORD"),
+                host=os.environ.get("DATABASE_URL", "127.0.0.1"),
+                port=os.environ.get("DATABASE_PORT", "5433"),
+                cursor_factory=CountingCursor,
+            )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _poolLock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
+def unit_of_work():
+    # Commits on success and rolls back on error. A unit of work opened while another one
+    # is active in the same thread joins it through a savepoint instead of taking a new connection.
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.depth += 1
+        savepoint = "uow_" + str(_local.depth)
+        with conn.cursor() as cur:
+            cur.execute("SAVEPOINT " + savepoint)
+        try:
+            yield conn
+            with conn.cursor() as cur:
+                cur.execute("RELEASE SAVEPOINT " + savepoint)
+        except BaseException:
+            with conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT " + savepoint)
+            raise
+        finally:
+            _local.depth -= 1
+        return
+
+    _poolSlots.acquire()
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+    except BaseException:
+        _poolSlots.release()
+        raise
+    _local.conn = conn
+    _local.depth = 0
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        pool.putconn(conn)
+        _poolSlots.release()
+
+
+def csv_field(value):
+    # COPY ... CSV reads an unquoted empty field as NULL and a quoted one as '', so None
+    # is written bare and every other non-numeric value quoted to keep '' distinct.
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class Record:
+    # Row of a table. Subclasses set __slots__ to the table's column tuple: it gives the
+    # constructor argument order, values() and the columns bulk_upsert writes, without a per-instance __dict__.
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._getter = attrgetter(*cls.__slots__)
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self.__slots__):
+            raise TypeError(type(self).__name__ + ' takes at most ' + str(len(self.__slots__)) + ' values')
+        for column, value in zip(self.__slots__, args):
+            setattr(self, column, value)
+        for column in self.__slots__[len(args):]:
+            setattr(self, column, kwargs.pop(column, None))
+        if kwargs:
+            raise TypeError('Unknown ' + type(self).__name__ + ' columns: ' + ', '.join(kwargs))
+
+    def values(self):
+        return self._getter(self)
+
+
+class UpsertResult(namedtuple('UpsertResult', ['inserted', 'updated', 'unchanged'])):
+    def __str__(self):
+        return str(self.inserted) + ' inserted, ' + str(self.updated) + ' updated, ' + str(self.unchanged) + ' unchanged'
+
+
+def bulk_upsert(conn, table, columns, keyColumns, rows, updateOnConflict = True):
+    # Streams rows into a temp staging table with COPY, then merges them into the table
+    # with a single INSERT ... SELECT. When a key appears more than once, the last row wins.
+    # Rows identical to the stored ones are left untouched instead of being rewritten.
+    if len(rows) == 0:
+        return UpsertResult(0, 0, 0)
+
+    staging = 'staging_' + table.lower()
+    columnList = ', '.join(columns)
+    keyList = ', '.join(keyColumns)
+    keyIndexes = [columns.index(column) for column in keyColumns]
+    staged = len(set(tuple(row[i] for i in keyIndexes) for row in rows))
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(csv_field(value) for value in row) + '\n')
+    buffer.seek(0)
+
+    if updateOnConflict:
+        updateColumns = [column for column in columns if column not in keyColumns]
+        onConflict = (
+            'DO UPDATE SET ' + ', '.join(column + ' = excluded.' + column for column in updateColumns)
+            + ' WHERE (' + ', '.join(table + '.' + column for column in updateColumns) + ')'
+            + ' IS DISTINCT FROM (' + ', '.join('excluded.' + column for column in updateColumns) + ')'
+        )
+    else:
+        onConflict = 'DO NOTHING'
+
+    with conn.cursor() as cur:
+        cur.execute('DROP TABLE IF EXISTS ' + staging)
+        cur.execute('CREATE TEMP TABLE ' + staging + ' (LIKE ' + table + ' INCLUDING DEFAULTS, stagingRow SERIAL)')
+        cur.copy_expert('COPY ' + staging + ' (' + columnList + ') FROM STDIN WITH (FORMAT csv)', buffer)
+        # xmax is 0 on freshly inserted rows, only the two counts come back to the client
+        cur.execute(
+            'WITH merged AS ('
+            + 'INSERT INTO ' + table + ' (' + columnList + ') '
+            + 'SELECT DISTINCT ON (' + keyList + ') ' + columnList + ' FROM ' + staging + ' '
+            + 'ORDER BY ' + keyList + ', stagingRow DESC '
+            + 'ON CONFLICT (' + keyList + ') ' + onConflict + ' '
+            + 'RETURNING xmax = 0 AS inserted'
+            + ') SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged'
+        )
+        inserted, updated = cur.fetchone()
+        cur.execute('DROP TABLE ' + staging)
+    return UpsertResult(inserted, updated, staged - inserted - updated)
@@ -1,108 +1,148 @@
 import os
 import psycopg2
 import traceback
-from nhlpy import NHLClient
+from psycopg2.extras import execute_values
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
-client = NHLClient()
-
-class Game:
-    def __init__(
-        self,
-        gameId,
-        season,
-        gameType,
-        startTimeUTC,
-        venue,
-        awayTeamAbbrev,
-        awayTeamScore,
-        homeTeamAbbrev,
-        homeTeamScore,
-        gameOutcome,
-        recapLink,
-        gameCenterLink,
-    ):
-        self.gameId = gameId
-        self.season = season
-        self.gameType = gameType
-        self.startTimeUTC = startTimeUTC
-        self.venue = venue
-        self.awayTeamAbbrev = awayTeamAbbrev
-        self.awayTeamScore = awayTeamScore
-        self.homeTeamAbbrev = homeTeamAbbrev
-        self.homeTeamScore = homeTeamScore
-        self.gameOutcome = gameOutcome
-        self.recapLink = recapLink
-        self.gameCenterLink = gameCenterLink
-
-    def values(self):
-        return (
-            self.gameId,
-            self.season,
-            self.gameType,
-            self.startTimeUTC,
-            self.venue,
-            self.awayTeamAbbrev,
-            self.awayTeamScore,
-            self.homeTeamAbbrev,
-            self.homeTeamScore,
-            self.gameOutcome,
-            self.recapLink,
-            self.gameCenterLink,
-        )
+from controllers.db import Record, unit_of_work, bulk_upsert
+from controllers.api import client
+from controllers.metrics import metrics
+
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "8"))
+
+# Schedule game states before the puck drops
+NOT_STARTED_STATES = ('FUT', 'PRE')
+# Schedule states of games that won't be played at their scheduled time
+UNPLAYABLE_SCHEDULE_STATES = ('PPD', 'CNCL')
+
+GAME_COLUMNS = (
+    'gameId',
+    'season',
+    'gameType',
+    'startTimeUTC',
+    'venue',
+    'awayTeamAbbrev',
+    'awayTeamScore',
+    'homeTeamAbbrev',
+    'homeTeamScore',
+    'gameOutcome',
+    'recapLink',
+    'gameCenterLink',
+)
+
+class Game(Record):
+    __slots__ = GAME_COLUMNS
 
 
 def save_games_to_db(games):
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_URL", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
+        with metrics.span('db write'), unit_of_work() as conn:
+            print('Saving ' + str(len(games)) + ' games')
+            result = bulk_upsert(conn, 'games', GAME_COLUMNS, ('gameId',), [game.values() for game in games])
+            metrics.add_rows('games', result)
+            print('Done. ' + str(result))
+        return True
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        metrics.error('db write', error)
+        return False
+
+
+def createGameSyncTable():
+    sql = '''
+        CREATE TABLE IF NOT EXISTS gameSyncState (
+            gameId BIGINT PRIMARY KEY,
+            gameState VARCHAR(10),
+            lastFetched TIMESTAMP,
+            done BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        '''
+    try:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                insertGames_sql = """ INSERT INTO games values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                        ON CONFLICT (gameId) DO UPDATE
-                            SET season = excluded.season,
-                                gameType = excluded.gameType,
-                                startTimeUTC = excluded.startTimeUTC,
-                                venue = excluded.venue,
-                                awayTeamAbbrev = excluded.awayTeamAbbrev,
-                                awayTeamScore = excluded.awayTeamScore,
-                                homeTeamAbbrev = excluded.homeTeamAbbrev,
-                                homeTeamScore = excluded.homeTeamScore,
-                                gameOutcome = excluded.gameOutcome,
-                                recapLink = excluded.recapLink,
-                                gameCenterLink = excluded.gameCenterLink
-                        RETURNING *
-                    """
-                print('Saving ' + str(len(games)) + ' games')
-                cur.executemany(insertGames_sql, [game.values() for game in games])
-                print('Done.')
+                cur.execute(sql)
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
 
 
-def get_season_games():
-    # 1. Get current season start and end date
-    todaySchedule = client.schedule.get_schedule()
-    startDate = datetime.strptime(todaySchedule["preSeasonStartDate"], "%Y-%m-%d")
-    endDate = datetime.strptime(todaySchedule["playoffEndDate"], "%Y-%m-%d")
+def get_games_to_sync(games):
+    # Started games whose gamelogs are not final in the database yet.
+    startedGames = [game for game in games if game.gameOutcome != "FUT"]
+    if len(startedGames) == 0:
+        return []
 
-    games = []
-    # 2. Loop every week for this season
+    doneGames = set()
+    try:
+        with metrics.span('sync state'), unit_of_work() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT gameId FROM gameSyncState WHERE done AND gameId IN %s', (tuple(game.gameId for game in startedGames),))
+                doneGames = set(row[0] for row in cur.fetchall())
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        metrics.error('sync state', error)
+    return [game for game in startedGames if game.gameId not in doneGames]
+
+
+def save_games_sync_state(gameStates):
+    # gameStates: (gameId, gameState) of the games whose gamelogs were written. A game is done
+    # once it is final, callers leave out the games whose write failed so they get fetched again.
+    if len(gameStates) == 0:
+        return
+
+    sql = '''
+        INSERT INTO gameSyncState (gameId, gameState, lastFetched, done)
+        SELECT s.gameId, s.gameState, now(), s.gameState IN ('OFF', 'FINAL')
+        FROM (VALUES %s) AS s (gameId, gameState)
+        ON CONFLICT (gameId) DO UPDATE
+            SET gameState = excluded.gameState,
+                lastFetched = excluded.lastFetched,
+                done = excluded.done
+        '''
+    try:
+        with metrics.span('sync state'), unit_of_work() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, sql, list(gameStates), page_size=len(gameStates))
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        metrics.error('sync state', error)
+
+
+def get_season_games(season = None):
+    # 1. Get season start and end date, current season by default
+    with metrics.span('schedule fetch'):
+        if season is None:
+            seasonSchedule = client.schedule.get_schedule()
+        else:
+            # Mid-January falls within every season, including the late-starting 20202021 one
+            seasonSchedule = client.schedule.get_schedule(season[4:] + '-01-15')
+    startDate = datetime.strptime(seasonSchedule["preSeasonStartDate"], "%Y-%m-%d")
+    endDate = datetime.strptime(seasonSchedule["playoffEndDate"], "%Y-%m-%d")
+
+    # 2. Fetch every week of this season concurrently, games are deduped by id
     print('Getting games from ' + str(startDate) + ' to ' + str(endDate))
+    weeks = []
     currentDate = startDate
     while currentDate <= endDate:
-        games += get_week_games(currentDate)
+        weeks.append(currentDate)
         currentDate += timedelta(days=7)
-    
+
+    gamesById = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for weekGames in executor.map(get_week_games, weeks):
+            for game in weekGames:
+                if season is None or str(game.season) == season:
+                    gamesById[game.gameId] = game
+
+    games = list(gamesById.values())
     print ('Got ' + str(len(games)) + ' games')
     return games
 
 def get_week_games(date: datetime):
     games = []
-    gameWeek = client.schedule.get_schedule(date.strftime("%Y-%m-%d"))
+    with metrics.span('schedule fetch'):
+        gameWeek = client.schedule.get_schedule(date.strftime("%Y-%m-%d"))
     for gameDay in gameWeek["gameWeek"]:
         for game in gameDay["games"]:
             games.append(Game(
@@ -112,33 +152,90 @@ def get_week_games(date: datetime):
                 game['startTimeUTC'],
                 game['venue']['default'],
                 game['awayTeam']['abbrev'],
-                game['awayTeam']['score'] if game['gameState'] != 'FUT' else None,
+                game['awayTeam']['score'] if game['gameState'] not in NOT_STARTED_STATES else None,
                 game['homeTeam']['abbrev'],
-                game['homeTeam']['score'] if game['gameState'] != 'FUT' else None,
-                game['gameOutcome']['lastPeriodType'] if game['gameState'] != 'FUT' else 'FUT',
+                game['homeTeam']['score'] if game['gameState'] not in NOT_STARTED_STATES else None,
+                # Live games have no outcome yet
+                game.get('gameOutcome', {}).get('lastPeriodType') if game['gameState'] not in NOT_STARTED_STATES else 'FUT',
                 'https://nhl.com/' + game['threeMinRecap'] if 'threeMinRecap' in game else "",
                 'https://nhl.com/' + game['gameCenterLink'] if 'gameCenterLink' in game else ""
             ))
     return games
 
-def fetch_strength_points(playerId, gameGoals, strength, goals = True, assists = True):
-    ppp = 0
-    for period in gameGoals:
-        for goal in period['goals']:
-            if goal['strength'] == strength or strength == 'all':
-                if goals and goal['playerId'] == playerId:
-                    ppp += 1
-                if assists:
-                    for assist in goal['assists']:
-                        if assist['playerId'] == playerId:
-                            ppp += 1
-    return ppp
-
-def fetch_ot_goals(playerId, gameGoals):
-    otGoals = 0
-    for period in gameGoals:
-        if period['periodDescriptor']['periodType'] == 'OT':
+class GameScoringIndex:
+    # Built once per game from the landing summary.scoring payload.
+    def __init__(self, gameGoals):
+        self.goals = Counter()   # (playerId, strength) -> goals
+        self.assists = Counter() # (playerId, strength) -> assists
+        self.otGoals = Counter() # playerId -> overtime goals
+        self.gameWinningGoalScorer = None
+
+        scoringGoals = []
+        for period in gameGoals:
+            periodType = period['periodDescriptor']['periodType']
             for goal in period['goals']:
-                if goal['playerId'] == playerId:
-                    otGoals += 1
-    return otGoals
\ No newline at end of file
+                for strength in (goal['strength'], 'all'):
+                    self.goals[(goal['playerId'], strength)] += 1
+                    for assist in goal['assists']:
+                        self.assists[(assist['playerId'], strength)] += 1
+                if periodType == 'OT':
+                    self.otGoals[goal['playerId']] += 1
+                if periodType != 'SO':
+                    scoringGoals.append(goal)
+
+        # The winning goal is the one that puts the winner one goal past the loser's final score.
+        if len(scoringGoals) > 0:
+            finalAway = scoringGoals[-1]['awayScore']
+            finalHome = scoringGoals[-1]['homeScore']
+            if finalAway != finalHome:
+                winnerKey = 'homeScore' if finalHome > finalAway else 'awayScore'
+                loserScore = min(finalAway, finalHome)
+                for goal in scoringGoals:
+                    if goal[winnerKey] == loserScore + 1:
+                        self.gameWinningGoalScorer = goal['playerId']
+                        break
+
+    def points(self, playerId, strength, goals = True, assists = True):
+        points = 0
+        if goals:
+            points += self.goals[(playerId, strength)]
+        if assists:
+            points += self.assists[(playerId, strength)]
+        return points
+
+    def ot_goals(self, playerId):
+        return self.otGoals[playerId]
+
+    def game_winning_goals(self, playerId):
+        return 1 if self.gameWinningGoalScorer == playerId else 0
+
+def fetch_game_payloads(game: Game):
+    # The request governor paces these calls
+    with metrics.span('boxscore fetch'):
+        boxScore = client.game_center.boxscore(game.gameId)
+        landing = client.game_center.landing(game.gameId)
+    return boxScore, landing
+
+
+def fetch_games_payloads(games, workers = FETCH_WORKERS):
+    # Yields (game, boxScore, landing) as soon as each game's payloads are fetched.
+    # At most 2 x workers games are in flight, so a slow consumer doesn't pile up payloads.
+    remaining = iter(games)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for game in islice(remaining, workers * 2):
+            futures[executor.submit(fetch_game_payloads, game)] = game
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                game = futures.pop(future)
+                for nextGame in islice(remaining, 1):
+                    futures[executor.submit(fetch_game_payloads, nextGame)] = nextGame
+                try:
+                    boxScore, landing = future.result()
+                except Exception as error:
+                    print('Cannot fetch game ' + str(game.gameId))
+                    traceback.print_exc()
+                    metrics.error('boxscore fetch', error)
+                    continue
+                yield game, boxScore, landing
@@ -1,106 +1,56 @@
 import os
 import psycopg2
 import traceback
-from nhlpy import NHLClient
 from datetime import datetime
-import requests
-from controllers.game import Game, get_season_games, fetch_strength_points
-from controllers.season import get_season_from_date
+from controllers.api import client, get_url
+from controllers.db import Record, unit_of_work, bulk_upsert
+from controllers.game import Game, GameScoringIndex, get_season_games
+from controllers.metrics import metrics
+from controllers.season import get_season_from_date, season_cayenne
 
-client = NHLClient()
 playerIds = []
 
+GOALIE_BIOS_URL = "https://api.nhle.com/stats/rest/en/goalie/bios"
+BOOTSTRAP_BATCH_SIZE = 100
 
-class Goaler:
-    def __init__(
-        self,
-        playerId,
-        fullName=None,
-        assists=None,
-        gamesPlayed=None,
-        gamesStarted=None,
-        goals=None,
-        goalsAgainst=None,
-        goalsAgainstAverage=None,
-        losses=None,
-        otLosses=None,
-        penaltyMinutes=None,
-        points=None,
-        savePct=None,
-        saves=None,
-        shootsCatches=None,
-        shotsAgainst=None,
-        shutouts=None,
-        teamAbbrev=None,
-        ties=None,
-        timeOnIce=None,
-        wins=None,        
-        headshot = None,
-        age = None,
-        height = None,
-        weight = None,
-        birthCountry = None,
-    ):
-        self.playerId = playerId
-        self.fullName = fullName
-        self.assists = assists
-        self.gamesPlayed = gamesPlayed
-        self.gamesStarted = gamesStarted
-        self.goals = goals
-        self.goalsAgainst = goalsAgainst
-        self.goalsAgainstAverage = goalsAgainstAverage
-        self.losses = losses
-        self.otLosses = otLosses
-        self.penaltyMinutes = penaltyMinutes
-        self.points = points
-        self.savePct = savePct
-        self.saves = saves
-        self.shootsCatches = shootsCatches
-        self.shotsAgainst = shotsAgainst
-        self.shutouts = shutouts
-        self.teamAbbrev = teamAbbrev
-        self.ties = ties
-        self.timeOnIce = timeOnIce
-        self.wins = wins
-        self.headshot = headshot
-        self.age = age
-        self.height = height
-        self.weight = weight
-        self.birthCountry = birthCountry
 
+GOALER_COLUMNS = (
+    'playerId',
+    'fullName',
+    'assists',
+    'gamesPlayed',
+    'gamesStarted',
+    'goals',
+    'goalsAgainst',
+    'goalsAgainstAverage',
+    'losses',
+    'otLosses',
+    'penaltyMinutes',
+    'points',
+    'savePct',
+    'saves',
+    'shootsCatches',
+    'shotsAgainst',
+    'shutouts',
+    'teamAbbrev',
+    'ties',
+    'timeOnIce',
+    'wins',
+    'headshot',
+    'age',
+    'height',
+    'weight',
+    'birthCountry',
+    'birthDate',
+    'bioUpdatedAt',
+)
 
-    def values(self):
-        return (
-            self.playerId,
-            self.fullName,
-            self.assists,
-            self.gamesPlayed,
-            self.gamesStarted,
-            self.goals,
-            self.goalsAgainst,
-            self.goalsAgainstAverage,
-            self.losses,
-            self.otLosses,
-            self.penaltyMinutes,
-            self.points,
-            self.savePct,
-            self.saves,
-            self.shootsCatches,
-            self.shotsAgainst,
-            self.shutouts,
-            self.teamAbbrev,
-            self.ties,
-            self.timeOnIce,
-            self.wins,
-            self.headshot,
-            self.age,
-            self.height,
-            self.weight,
-            self.birthCountry,
-        )
+class Goaler(Record):
+    __slots__ = GOALER_COLUMNS
 
-    def update_infos(self, date: datetime, skater_stats=None):
-        season = get_season_from_date(date)
+    def update_infos(self, date: datetime, skater_stats=None, season=None, bio=None):
+        if season is None:
+            season = get_season_from_date(date)
 
         if skater_stats is None:
             skater_stats = client.stats.goalie_stats_summary_simple(
@@ -138,207 +88,150 @@ class Goaler:
         self.wins = skater_stats["wins"]
         self.headshot = 'https://assets.nhle.com/mugs/nhl/' + str(season) + '/' + str(self.playerId) + '/' + str(self.teamAbbrev) + '.png'
 
+        if bio is not None:
+            self.update_bio(bio["birthDate"], bio["height"], bio["weight"], bio["birthCountryCode"])
+            return self
+
         url = "https://api-web.nhle.com/v1/player/" + str(self.playerId) + "/landing"
-        response = requests.get(url)
+        response = get_url(url)
 
         if response.status_code == 200:
             result = response.json()
-            birthDate = datetime.strptime(result["birthDate"], "%Y-%m-%d")
-            today = datetime.now()
-            self.age = (today.year - birthDate.year - ((today.month, today.day) < (birthDate.month, birthDate.day)))
-            self.height = result["heightInInches"]
-            self.weight = result["weightInPounds"]
-            self.birthCountry = result["birthCountry"]
+            self.update_bio(result["birthDate"], result["heightInInches"], result["weightInPounds"], result["birthCountry"])
+        else:
+            print("Cannot get bio of goaler " + str(self.playerId) + ", status code " + str(response.status_code))
 
         return self
 
+    def update_from_landing(self):
+        # Minimal row from the player landing, for goalers the stats summary doesn't know yet.
+        response = get_url("https://api-web.nhle.com/v1/player/" + str(self.playerId) + "/landing")
+        if response.status_code != 200:
+            print("Cannot get landing of goaler " + str(self.playerId) + ", status code " + str(response.status_code))
+            return None
+
+        landing = response.json()
+        self.fullName = landing["firstName"]["default"] + " " + landing["lastName"]["default"]
+        self.shootsCatches = landing.get("shootsCatches")
+        self.teamAbbrev = landing.get("currentTeamAbbrev")
+        self.headshot = landing.get("headshot")
+        self.update_bio(landing["birthDate"], landing.get("heightInInches"), landing.get("weightInPounds"), landing.get("birthCountry"))
+        return self
+
+    def update_bio(self, birthDate, height, weight, birthCountry):
+        birthDate = datetime.strptime(birthDate, "%Y-%m-%d")
+        today = datetime.now()
+        self.age = (today.year - birthDate.year - ((today.month, today.day) < (birthDate.month, birthDate.day)))
+        self.height = height
+        self.weight = weight
+        self.birthCountry = birthCountry
+        self.birthDate = birthDate.strftime("%Y-%m-%d")
+        self.bioUpdatedAt = today
+
+
+def bootstrap_goalers(goalersIds, date: datetime, gameType=2):
+    # One summary and one bios request per batch instead of three requests per goaler.
+    season = get_season_from_date(date)
+    goalers = []
+    for i in range(0, len(goalersIds), BOOTSTRAP_BATCH_SIZE):
+        batch = goalersIds[i:i + BOOTSTRAP_BATCH_SIZE]
+        cayenne = season_cayenne(season, gameType, batch)
+        summaries = {row["playerId"]: row for row in client.stats.goalie_stats_summary_simple(start_season=season, end_season=season, limit=-1, default_cayenne_exp=cayenne)}
+        bios = {row["playerId"]: row for row in get_url(GOALIE_BIOS_URL, {
+            "isAggregate": False,
+            "isGame": False,
+            "start": 0,
+            "limit": -1,
+            "cayenneExp": cayenne,
+        }).json()["data"]}
+
+        for playerId in batch:
+            if int(playerId) not in summaries:
+                # Their gamelogs still need the row, fall back to the player landing
+                print("Goaler not in season summary " + str(playerId) + ", using landing")
+                goaler = Goaler(playerId=playerId).update_from_landing()
+                if goaler is not None:
+                    goalers.append(goaler)
+                continue
+            goalers.append(Goaler(playerId=playerId).update_infos(date, summaries[int(playerId)], season, bios.get(int(playerId))))
+    return goalers
+
 
 def save_goalers_to_db(goalers, updateOnConflict=True):
     if len(goalers) == 0:
         return
     
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_NAME", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
-            with conn.cursor() as cur:
-                if updateOnConflict:
-
-                    insert_sql = """
-                        INSERT INTO goalers values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                        ON CONFLICT (playerId) DO UPDATE
-                            SET fullName = excluded.fullName,
-                                assists = excluded.assists,
-                                gamesPlayed = excluded.gamesPlayed,
-                                gamesStarted = excluded.gamesStarted,
-                                goals = excluded.goals,
-                                goalsAgainst = excluded.goalsAgainst,
-                                goalsAgainstAverage = excluded.goalsAgainstAverage,
-                                losses = excluded.losses,
-                                otLosses = excluded.otLosses,
-                                penaltyMinutes = excluded.penaltyMinutes,
-                                points = excluded.points,
-                                savePct = excluded.savePct,
-                                saves = excluded.saves,
-                                shootsCatches = excluded.shootsCatches,
-                                shotsAgainst = excluded.shotsAgainst,
-                                shutouts = excluded.shutouts,
-                                teamAbbrev = excluded.teamAbbrev,
-                                ties = excluded.ties,
-                                timeOnIce = excluded.timeOnIce,
-                                wins = excluded.wins,
-                                headshot = excluded.headshot,
-                                age = excluded.age,
-                                height = excluded.height,
-                                weight = excluded.weight,
-                                birthCountry = excluded.birthCountry
-                        RETURNING *
-                    """
-                else:
-                    insert_sql = """
-                        INSERT INTO goalers values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                        ON CONFLICT (playerId) DO NOTHING
-                        RETURNING *
-                    """
-                print('Inserting ' + str(len(goalers)) + ' goalers')
-                cur.executemany(insert_sql, [goaler.values() for goaler in goalers])
-                print('Done.')
+        with metrics.span('db write'), unit_of_work() as conn:
+            print('Inserting ' + str(len(goalers)) + ' goalers')
+            result = bulk_upsert(conn, 'goalers', GOALER_COLUMNS, ('playerId',), [goaler.values() for goaler in goalers], updateOnConflict)
+            metrics.add_rows('goalers', result)
+            print('Done. ' + str(result))
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('db write', error)
 
 
-def save_goalers_if_not_exists(goalersIds, gameDate: datetime):
+def save_goalers_if_not_exists(goalersIds, gameDate: datetime, gameType=2):
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_URL", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
-            with conn.cursor() as cur:
-                select_sql = """
-                    SELECT playerId from goalers where playerId in %s
-                """
-                strGoalersIds = [str(playerId) for playerId in goalersIds]
-                cur.execute(select_sql, (tuple(strGoalersIds),))
-                saved_goalers = cur.fetchall()
-                saved_goalers = [goaler[0] for goaler in saved_goalers]
-                goalers_to_insert = [
-                    goaler for goaler in strGoalersIds if goaler not in saved_goalers
-                ]
+        with metrics.span('player bootstrap'):
+            # The connection goes back to the pool before the bootstrap requests
+            with unit_of_work() as conn:
+                with conn.cursor() as cur:
+                    select_sql = """
+                        SELECT playerId from goalers where playerId in %s
+                    """
+                    cur.execute(select_sql, (tuple(goalersIds),))
+                    saved_goalers = set(goaler[0] for goaler in cur.fetchall())
 
-                if len(goalers_to_insert) > 0:
-                    save_goalers_to_db([ Goaler(playerId=goaler).update_infos(gameDate) for goaler in goalers_to_insert ])
+            goalers_to_insert = [
+                goaler for goaler in goalersIds if goaler not in saved_goalers
+            ]
+            if len(goalers_to_insert) > 0:
+                save_goalers_to_db(bootstrap_goalers(goalers_to_insert, gameDate, gameType))
 
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('player bootstrap', error)
 
-class GoalerGameLog:
-    def __init__(
-        self,
-        gameLogsId,
-        gameId,
-        playerId,
-        teamAbbrev,
-        homeRoadFlag,
-        gameDate,
-        goals,
-        assists,
-        gamesStarted,
-        decision,
-        shotsAgainst,
-        goalsAgainst,
-        savePctg,
-        shutouts,
-        opponentAbbrev,
-        pim,
-        toi,
-        gameType,
-    ):
-        self.gameLogsId = gameLogsId
-        self.gameId = gameId
-        self.playerId = playerId
-        self.teamAbbrev = teamAbbrev
-        self.homeRoadFlag = homeRoadFlag
-        self.gameDate = gameDate
-        self.goals = goals
-        self.assists = assists
-        self.gamesStarted = gamesStarted
-        self.decision = decision
-        self.shotsAgainst = shotsAgainst
-        self.goalsAgainst = goalsAgainst
-        self.savePctg = savePctg
-        self.shutouts = shutouts
-        self.opponentAbbrev = opponentAbbrev
-        self.pim = pim
-        self.toi = toi
-        self.gameType = gameType
+GOALER_GAMELOG_COLUMNS = (
+    'gameId',
+    'playerId',
+    'teamAbbrev',
+    'homeRoadFlag',
+    'gameDate',
+    'goals',
+    'assists',
+    'gamesStarted',
+    'decision',
+    'shotsAgainst',
+    'goalsAgainst',
+    'savePctg',
+    'shutouts',
+    'opponentAbbrev',
+    'pim',
+    'toi',
+    'gameType',
+)
 
-    def values(self):
-        return (
-            self.gameLogsId,
-            self.gameId,
-            self.playerId,
-            self.teamAbbrev,
-            self.homeRoadFlag,
-            self.gameDate,
-            self.goals,
-            self.assists,
-            self.gamesStarted,
-            self.decision,
-            self.shotsAgainst,
-            self.goalsAgainst,
-            self.savePctg,
-            self.shutouts,
-            self.opponentAbbrev,
-            self.pim,
-            self.toi,
-            self.gameType,
-        )
+class GoalerGameLog(Record):
+    __slots__ = GOALER_GAMELOG_COLUMNS
 
 
 def save_goaler_gamelogs_to_db(goalergamelogs):
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_URL", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
-            with conn.cursor() as cur:
-                gameLogsSql = """ INSERT INTO goalerGameLogs values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                                    ON CONFLICT (gameLogsId) DO UPDATE
-                                        SET gameId = excluded.gameId,
-                                            playerId = excluded.playerId,
-                                            teamAbbrev = excluded.teamAbbrev,
-                                            homeRoadFlag = excluded.homeRoadFlag,
-                                            gameDate = excluded.gameDate,
-                                            goals = excluded.goals,
-                                            assists = excluded.assists,
-                                            gamesStarted = excluded.gamesStarted,
-                                            decision = excluded.decision,
-                                            shotsAgainst = excluded.shotsAgainst,
-                                            goalsAgainst = excluded.goalsAgainst,
-                                            savePctg = excluded.savePctg,
-                                            shutouts = excluded.shutouts,
-                                            opponentAbbrev = excluded.opponentAbbrev,
-                                            pim = excluded.pim,
-                                            toi = excluded.toi,
-                                            gameType = excluded.gameType
-                                """
-                print('Saving ' + str(len(goalergamelogs)) + ' goaler gamelogs')
-                cur.executemany(gameLogsSql, [goalergamelog.values() for goalergamelog in goalergamelogs])
-                print('Done.')
+        with metrics.span('db write'), unit_of_work() as conn:
+            print('Saving ' + str(len(goalergamelogs)) + ' goaler gamelogs')
+            result = bulk_upsert(conn, 'goalerGameLogs', GOALER_GAMELOG_COLUMNS, ('gameId', 'playerId'), [goalergamelog.values() for goalergamelog in goalergamelogs])
+            metrics.add_rows('goalerGameLogs', result)
+            print('Done. ' + str(result))
+        return True
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('db write', error)
+        return False
 
-def fetch_goaler_log(goalersBoxScore, game: Game, gameGoals, away: bool):
+def fetch_goaler_log(goalersBoxScore, game: Game, scoringIndex: GameScoringIndex, away: bool):
     gamelogs = []
     playerIds = []
     for goalerBoxScore in goalersBoxScore:
@@ -350,14 +243,13 @@ def fetch_goaler_log(goalersBoxScore, game: Game, gameGoals, away: bool):
         playerIds.append(goalerBoxScore["playerId"])
         gamelogs.append(
             GoalerGameLog(
-                str(game.gameId) + str(goalerBoxScore['playerId']),
                 game.gameId,
                 goalerBoxScore['playerId'],
                 game.awayTeamAbbrev if away else game.homeTeamAbbrev,
                 'R' if away else 'H',
                 game.startTimeUTC,
-                fetch_strength_points(goalerBoxScore['playerId'], gameGoals, 'all', True, False),
-                fetch_strength_points(goalerBoxScore['playerId'], gameGoals, 'all', False, True), 
+                scoringIndex.points(goalerBoxScore['playerId'], 'all', True, False),
+                scoringIndex.points(goalerBoxScore['playerId'], 'all', False, True),
                 1 if 'starter' in goalerBoxScore and goalerBoxScore['starter'] == 'true' else 0,
                 goalerBoxScore['decision'] if 'decision' in goalerBoxScore else '',
                 int(goalerBoxScore['saveShotsAgainst'].split('/')[1]),
@@ -371,5 +263,5 @@ def fetch_goaler_log(goalersBoxScore, game: Game, gameGoals, away: bool):
             )
         )
 
-    save_goalers_if_not_exists(playerIds, datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ'))
+    save_goalers_if_not_exists(playerIds, datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ'), game.gameType)
     return gamelogs
@@ -0,0 +1,186 @@
+import os
+import time
+import random
+import httpx
+import threading
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+# Requests per second allowed to leave the process, and how many can go out at once after an idle period
+API_RATE_LIMIT = float(os.environ.get("API_RATE_LIMIT", "10"))
+API_RATE_BURST = int(os.environ.get("API_RATE_BURST", "10"))
+API_MAX_RETRIES = int(os.environ.get("API_MAX_RETRIES", "5"))
+# Backoff before retry n is a random delay up to min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2^n) seconds
+API_BACKOFF_BASE = float(os.environ.get("API_BACKOFF_BASE", "0.5"))
+API_BACKOFF_MAX = float(os.environ.get("API_BACKOFF_MAX", "30"))
+# Consecutive failed attempts that open the circuit, and how long it stays open
+API_BREAKER_THRESHOLD = int(os.environ.get("API_BREAKER_THRESHOLD", "10"))
+API_BREAKER_COOLDOWN = float(os.environ.get("API_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updatedAt = time.monotonic()
+        self.pausedUntil = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available, returns the seconds spent waiting.
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+                self.updatedAt = now
+                if now >= self.pausedUntil and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.pausedUntil - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        # A 429 slows every thread down, not just the one that got it.
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class CircuitBreaker:
+    # closed: requests go through. open: they fail fast until the cooldown is over.
+    # half-open: one trial request decides whether to close or open again.
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.openedAt = None
+        self.trialRunning = False
+        self.lock = threading.Lock()
+
+    def before(self):
+        with self.lock:
+            if self.openedAt is None:
+                return
+            if time.monotonic() - self.openedAt < self.cooldown or self.trialRunning:
+                raise CircuitOpenError('NHL API circuit open after ' + str(self.failures) + ' consecutive failures')
+            self.trialRunning = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.trialRunning = False
+
+    def failure(self):
+        # Returns True when this failure opened the circuit.
+        with self.lock:
+            self.failures += 1
+            self.trialRunning = False
+            if self.openedAt is not None or self.failures >= self.threshold:
+                opened = self.openedAt is None
+                self.openedAt = time.monotonic()
+                return opened
+            return False
+
+
+def retry_after(response):
+    # Retry-After is either seconds or an HTTP date
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestGovernor:
+    # Every request that reaches the network goes through call(): rate limited, retried with
+    # jittered exponential backoff on 429/5xx and connection errors, and failed fast when the API is down.
+    def __init__(self, rate = API_RATE_LIMIT, burst = API_RATE_BURST, maxRetries = API_MAX_RETRIES,
+                 backoffBase = API_BACKOFF_BASE, backoffMax = API_BACKOFF_MAX,
+                 breakerThreshold = API_BREAKER_THRESHOLD, breakerCooldown = API_BREAKER_COOLDOWN):
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breakerThreshold, breakerCooldown)
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.stats = Counter()
+        self.statsLock = threading.Lock()
+
+    def count(self, name, value = 1):
+        with self.statsLock:
+            self.stats[name] += value
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoffMax, self.backoffBase * 2 ** attempt))
+
+    def call(self, send):
+        # send() performs one HTTP request and returns its response. Returns the first response
+        # that isn't retryable, raises once retries are exhausted or the circuit is open.
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before()
+            except CircuitOpenError:
+                self.count('rejected')
+                raise
+            self.count('throttledSeconds', self.bucket.acquire())
+            self.count('requests')
+
+            delay = None
+            try:
+                response = send()
+            except httpx.TransportError as error:
+                self.count('connectionErrors')
+                if self.breaker.failure():
+                    self.count('breakerOpened')
+                if attempt >= self.maxRetries:
+                    self.count('failures')
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.success()
+                    return response
+
+                if response.status_code == 429:
+                    # The API is up and asking us to slow down, so only the bucket waits
+                    self.count('rateLimited')
+                    delay = retry_after(response)
+                    if delay is None:
+                        delay = self.backoff(attempt)
+                    self.bucket.pause(delay)
+                else:
+                    self.count('serverErrors')
+                    if self.breaker.failure():
+                        self.count('breakerOpened')
+                if attempt >= self.maxRetries:
+                    self.count('failures')
+                    response.raise_for_status()
+
+            if delay is None:
+                delay = self.backoff(attempt)
+            attempt += 1
+            self.count('retries')
+            self.count('backoffSeconds', delay)
+            time.sleep(delay)
+
+    def summary(self):
+        with self.statsLock:
+            stats = dict(self.stats)
+        return ', '.join(name + ': ' + (str(round(value, 1)) if isinstance(value, float) else str(value)) for name, value in sorted(stats.items()))
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from controllers.api import governor
+
+# Where the JSON log lines go: '-' for stdout, or a file they are appended to
+METRICS_LOG = os.environ.get("METRICS_LOG", "-")
+# node_exporter textfile collector directory, nhl_stats_<job>.prom is written there at the end of a run
+PROMETHEUS_TEXTFILE_DIR = os.environ.get("PROMETHEUS_TEXTFILE_DIR", "")
+
+PROMETHEUS_PREFIX = 'nhl_stats_'
+
+
+class StageStats:
+    __slots__ = ('calls', 'seconds', 'selfSeconds', 'maxSeconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.selfSeconds = 0.0
+        self.maxSeconds = 0.0
+
+
+class Metrics:
+    # Per-stage spans, rows written and errors of one run, shared by every thread.
+    # A span's self time leaves out the spans nested in it on the same thread, so
+    # the self times of all stages add up to the time the run actually spent in them.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+        self.rows = Counter()  # table -> rows inserted or updated
+        self.errors = Counter() # stage -> errors
+        self.startedAt = time.time()
+
+    @contextmanager
+    def span(self, stage):
+        children = getattr(self.local, 'children', None)
+        if children is None:
+            children = self.local.children = []
+        children.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            nested = children.pop()
+            if children:
+                children[-1] += seconds
+            with self.lock:
+                stats = self.stages.get(stage)
+                if stats is None:
+                    stats = self.stages[stage] = StageStats()
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.selfSeconds += seconds - nested
+                stats.maxSeconds = max(stats.maxSeconds, seconds)
+
+    def add_rows(self, table, result):
+        with self.lock:
+            self.rows[table] += result.inserted + result.updated
+
+    def error(self, stage, error):
+        with self.lock:
+            self.errors[stage] += 1
+        self.log('error', stage=stage, error=type(error).__name__, message=str(error))
+
+    def log(self, event, **fields):
+        line = json.dumps(dict({'time': round(time.time(), 3), 'event': event}, **fields), default=str)
+        if METRICS_LOG == '-':
+            print(line)
+            sys.stdout.flush()
+            return
+        with self.lock:
+            with open(METRICS_LOG, 'a') as f:
+                f.write(line + '\n')
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'seconds': round(time.time() - self.startedAt, 3),
+                'stages': {
+                    stage: {
+                        'calls': stats.calls,
+                        'seconds': round(stats.seconds, 3),
+                        'selfSeconds': round(stats.selfSeconds, 3),
+                        'maxSeconds': round(stats.maxSeconds, 3),
+                    }
+                    for stage, stats in sorted(self.stages.items())
+                },
+                'api': dict(governor.stats),
+                'rows': dict(self.rows),
+                'errors': dict(self.errors),
+            }
+
+    def finish(self, job):
+        # Logs the run summary and writes the Prometheus textfile if asked to.
+        summary = self.snapshot()
+        self.log('run', job=job, **summary)
+        if PROMETHEUS_TEXTFILE_DIR:
+            write_textfile(os.path.join(PROMETHEUS_TEXTFILE_DIR, PROMETHEUS_PREFIX + job + '.prom'), job, summary)
+        return summary
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_textfile(path, job, summary):
+    lines = []
+
+    def gauge(name, help, samples):
+        lines.append('# HELP ' + PROMETHEUS_PREFIX + name + ' ' + help)
+        lines.append('# TYPE ' + PROMETHEUS_PREFIX + name + ' gauge')
+        for labels, value in samples:
+            labels = dict({'job': job}, **labels)
+            lines.append(PROMETHEUS_PREFIX + name + '{' + ','.join(key + '="' + label_value(labels[key]) + '"' for key in labels) + '} ' + str(value))
+
+    stages = summary['stages']
+    gauge('last_run_timestamp_seconds', 'When the last run finished.', [({}, round(time.time(), 3))])
+    gauge('last_run_seconds', 'Wall time of the last run.', [({}, summary['seconds'])])
+    gauge('last_run_errors', 'Errors during the last run, all stages.', [({}, sum(summary['errors'].values()))])
+    gauge('stage_calls', 'Spans of each stage during the last run.', [({'stage': stage}, stats['calls']) for stage, stats in stages.items()])
+    gauge('stage_seconds', 'Time spent in each stage during the last run, nested stages included.', [({'stage': stage}, stats['seconds']) for stage, stats in stages.items()])
+    gauge('stage_self_seconds', 'Time spent in each stage during the last run, nested stages excluded.', [({'stage': stage}, stats['selfSeconds']) for stage, stats in stages.items()])
+    gauge('stage_max_seconds', 'Longest span of each stage during the last run.', [({'stage': stage}, stats['maxSeconds']) for stage, stats in stages.items()])
+    gauge('stage_errors', 'Errors of each stage during the last run.', [({'stage': stage}, count) for stage, count in summary['errors'].items()])
+    gauge('api_requests', 'NHL API requests of the last run by outcome.', [({'kind': kind}, count) for kind, count in sorted(summary['api'].items())])
+    gauge('rows_written', 'Rows inserted or updated during the last run.', [({'table': table}, count) for table, count in sorted(summary['rows'].items())])
+
+    # Written aside then renamed so the collector never reads half a file
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmpPath, path)
+
+
+metrics = Metrics()
@@ -1,114 +1,58 @@
 import os
 import psycopg2
 import traceback
-from nhlpy import NHLClient
 from datetime import datetime
-import requests
-from controllers.game import Game, get_season_games, fetch_strength_points, fetch_ot_goals
-from controllers.season import get_season_from_date
+from controllers.api import client, get_url
+from controllers.db import Record, unit_of_work, bulk_upsert
+from controllers.game import Game, GameScoringIndex, get_season_games
+from controllers.metrics import metrics
+from controllers.season import get_season_from_date, season_cayenne
 
-client = NHLClient()
 playerIds = []
 
+SKATER_BIOS_URL = 'https://api.nhle.com/stats/rest/en/skater/bios'
+BOOTSTRAP_BATCH_SIZE = 100
 
-class Player:
-    def __init__(
-        self,
-        playerId,
-        fullName = None,
-        goals = None,
-        assists = None,
-        evGoals = None,
-        evPoints = None,
-        faceoffWinPct = None,
-        gameWinningGoals = None,
-        gamesPlayed = None,
-        otGoals = None,
-        penaltyMinutes = None,
-        plusMinus = None,
-        points = None,
-        pointsPerGame = None,
-        positionCode = None,
-        ppGoals = None,
-        ppPoints = None,
-        shGoals = None,
-        shPoints = None,
-        shootingPct = None,
-        shootsCatches = None,
-        shots = None,
-        teamAbbrev = None,
-        timeOnIcePerGame = None,
-        headshot = None,
-        age = None,
-        height = None,
-        weight = None,
-        birthCountry = None,
-    ):
-        self.playerId = playerId
-        self.fullName = fullName
-        self.goals = goals
-        self.assists = assists
-        self.evGoals = evGoals
-        self.evPoints = evPoints
-        self.faceoffWinPct = faceoffWinPct
-        self.gameWinningGoals = gameWinningGoals
-        self.gamesPlayed = gamesPlayed
-        self.otGoals = otGoals
-        self.penaltyMinutes = penaltyMinutes
-        self.plusMinus = plusMinus
-        self.points = points
-        self.pointsPerGame = pointsPerGame
-        self.positionCode = positionCode
-        self.ppGoals = ppGoals
-        self.ppPoints = ppPoints
-        self.shGoals = shGoals
-        self.shPoints = shPoints
-        self.shootingPct = shootingPct
-        self.shootsCatches = shootsCatches
-        self.shots = shots
-        self.teamAbbrev = teamAbbrev
-        self.timeOnIcePerGame = timeOnIcePerGame
-        self.headshot = headshot
-        self.age = age
-        self.height = height
-        self.weight = weight
-        self.birthCountry = birthCountry
 
-    def values(self):
-        return (
-            self.playerId,
-            self.fullName,
-            self.goals,
-            self.assists,
-            self.evGoals,
-            self.evPoints,
-            self.faceoffWinPct,
-            self.gameWinningGoals,
-            self.gamesPlayed,
-            self.otGoals,
-            self.penaltyMinutes,
-            self.plusMinus,
-            self.points,
-            self.pointsPerGame,
-            self.positionCode,
-            self.ppGoals,
-            self.ppPoints,
-            self.shGoals,
-            self.shPoints,
-            self.shootingPct,
-            self.shootsCatches,
-            self.shots,
-            self.teamAbbrev,
-            self.timeOnIcePerGame,
-            self.headshot,
-            self.age,
-            self.height,
-            self.weight,
-            self.birthCountry,
-        )
-        
-    def update_infos(self, date: datetime, skater_stats = None):
-        currentSeason = get_season_from_date(date)
+PLAYER_COLUMNS = (
+    'playerId',
+    'fullName',
+    'goals',
+    'assists',
+    'evGoals',
+    'evPoints',
+    'faceoffWinPct',
+    'gameWinningGoals',
+    'gamesPlayed',
+    'otGoals',
+    'penaltyMinutes',
+    'plusMinus',
+    'points',
+    'pointsPerGame',
+    'positionCode',
+    'ppGoals',
+    'ppPoints',
+    'shGoals',
+    'shPoints',
+    'shootingPct',
+    'shootsCatches',
+    'shots',
+    'teamAbbrev',
+    'timeOnIcePerGame',
+    'headshot',
+    'age',
+    'height',
+    'weight',
+    'birthCountry',
+    'birthDate',
+    'bioUpdatedAt',
+)
+
+class Player(Record):
+    __slots__ = PLAYER_COLUMNS
+
+    def update_infos(self, date: datetime, skater_stats = None, season = None, bio = None):
+        currentSeason = season if season is not None else get_season_from_date(date)
         
         if skater_stats is None:
             skater_stats = client.stats.skater_stats_summary_simple(start_season=currentSeason, end_season=currentSeason, default_cayenne_exp='playerId=' + str(self.playerId))
@@ -144,246 +88,154 @@ class Player:
         self.timeOnIcePerGame = skater_stats['timeOnIcePerGame']
         self.headshot = 'https://assets.nhle.com/mugs/nhl/' + str(currentSeason) + '/' + str(self.playerId) + '/' + str(self.teamAbbrev) + '.png'
         
+        if bio is not None:
+            self.update_bio(bio['birthDate'], bio['height'], bio['weight'], bio['birthCountryCode'])
+            return self
+
         url = 'https://api-web.nhle.com/v1/player/' + str(self.playerId) + '/landing'
-        response = requests.get(url)
+        response = get_url(url)
 
         if response.status_code == 200:
             result = response.json()
-            birthDate = datetime.strptime(result['birthDate'], "%Y-%m-%d")
-            today = datetime.now()
-            self.age = today.year - birthDate.year - ((today.month, today.day) < (birthDate.month, birthDate.day))
-            self.height = result['heightInInches']
-            self.weight = result['weightInPounds']
-            self.birthCountry = result['birthCountry']
-            
+            self.update_bio(result['birthDate'], result['heightInInches'], result['weightInPounds'], result['birthCountry'])
+        else:
+            print('Cannot get bio of player ' + str(self.playerId) + ', status code ' + str(response.status_code))
+
+        return self
+
+    def update_from_landing(self):
+        # Minimal row from the player landing, for players the stats summary doesn't know yet.
+        response = get_url('https://api-web.nhle.com/v1/player/' + str(self.playerId) + '/landing')
+        if response.status_code != 200:
+            print('Cannot get landing of player ' + str(self.playerId) + ', status code ' + str(response.status_code))
+            return None
+
+        landing = response.json()
+        self.fullName = landing['firstName']['default'] + ' ' + landing['lastName']['default']
+        self.positionCode = landing.get('position')
+        self.shootsCatches = landing.get('shootsCatches')
+        self.teamAbbrev = landing.get('currentTeamAbbrev')
+        self.headshot = landing.get('headshot')
+        self.update_bio(landing['birthDate'], landing.get('heightInInches'), landing.get('weightInPounds'), landing.get('birthCountry'))
         return self
+
+    def update_bio(self, birthDate, height, weight, birthCountry):
+        birthDate = datetime.strptime(birthDate, "%Y-%m-%d")
+        today = datetime.now()
+        self.age = today.year - birthDate.year - ((today.month, today.day) < (birthDate.month, birthDate.day))
+        self.height = height
+        self.weight = weight
+        self.birthCountry = birthCountry
+        self.birthDate = birthDate.strftime("%Y-%m-%d")
+        self.bioUpdatedAt = today
     
+def bootstrap_players(playersIds, date: datetime, gameType=2):
+    # One summary and one bios request per batch instead of three requests per player.
+    season = get_season_from_date(date)
+    players = []
+    for i in range(0, len(playersIds), BOOTSTRAP_BATCH_SIZE):
+        batch = playersIds[i:i + BOOTSTRAP_BATCH_SIZE]
+        cayenne = season_cayenne(season, gameType, batch)
+        summaries = {row['playerId']: row for row in client.stats.skater_stats_summary_simple(start_season=season, end_season=season, limit=-1, default_cayenne_exp=cayenne)}
+        bios = {row['playerId']: row for row in get_url(SKATER_BIOS_URL, {
+            'isAggregate': False,
+            'isGame': False,
+            'start': 0,
+            'limit': -1,
+            'cayenneExp': cayenne,
+        }).json()['data']}
+
+        for playerId in batch:
+            if int(playerId) not in summaries:
+                # Their gamelogs still need the row, fall back to the player landing
+                print('player not in season summary ' + str(playerId) + ', using landing')
+                player = Player(playerId=playerId).update_from_landing()
+                if player is not None:
+                    players.append(player)
+                continue
+            players.append(Player(playerId=playerId).update_infos(date, summaries[int(playerId)], season, bios.get(int(playerId))))
+    return players
+
 def save_players_to_db(players, updateOnConflict=True):
     if len(players) == 0:
         return
     
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_URL", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
-            with conn.cursor() as cur:
-                if updateOnConflict:
-                    
-                    insert_sql = """
-                        INSERT INTO players values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT (playerId) DO UPDATE
-                            SET fullName = excluded.fullName,
-                                goals = excluded.goals,
-                                assists = excluded.assists,
-                                evGoals = excluded.evGoals,
-                                evPoints = excluded.evPoints,
-                                faceoffWinPct = excluded.faceoffWinPct,
-                                gameWinningGoals = excluded.gameWinningGoals,
-                                gamesPlayed = excluded.gamesPlayed,
-                                otGoals = excluded.otGoals,
-                                penaltyMinutes = excluded.penaltyMinutes,
-                                plusMinus = excluded.plusMinus,
-                                points = excluded.points,
-                                pointsPerGame = excluded.pointsPerGame,
-                                positionCode = excluded.positionCode,
-                                ppGoals = excluded.ppGoals,
-                                ppPoints = excluded.ppPoints,
-                                shGoals = excluded.shGoals,
-                                shPoints = excluded.shPoints,
-                                shootingPct = excluded.shootingPct,
-                                shootsCatches = excluded.shootsCatches,
-                                shots = excluded.shots,
-                                teamAbbrev = excluded.teamAbbrev,
-                                timeOnIcePerGame = excluded.timeOnIcePerGame,
-                                headshot = excluded.headshot,
-                                age = excluded.age,
-                                height = excluded.height,
-                                weight = excluded.weight,
-                                birthCountry = excluded.birthCountry
-                    """
-                else:
-                    insert_sql = """
-                        INSERT INTO players values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT (playerId) DO NOTHING
-                    """
-                print('Inserting ' + str(len(players)) + ' players')
-                cur.executemany(insert_sql, [player.values() for player in players])
-                print('Done.')
+        with metrics.span('db write'), unit_of_work() as conn:
+            print('Inserting ' + str(len(players)) + ' players')
+            result = bulk_upsert(conn, 'players', PLAYER_COLUMNS, ('playerId',), [player.values() for player in players], updateOnConflict)
+            metrics.add_rows('players', result)
+            print('Done. ' + str(result))
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('db write', error)
 
-def save_players_if_not_exists(playersIds, gameDate = datetime.now()):
+def save_players_if_not_exists(playersIds, gameDate = datetime.now(), gameType=2):
     try:
-        with psycopg2.connect(
-            database=os.environ.get("DATABASE_URL", "nhl-stats-fetcher"),
-            user=os.environ.get("DATABASE_USERNAME", "py-user"),
-            password=os.environ.get("DATABASE_PASSWORD"),
-            host=os.environ.get("DATABASE_URL", "127.0.0.1"),
-            port=os.environ.get("DATABASE_PORT", "5433"),
-        ) as conn:
-            with conn.cursor() as cur:
-                select_sql = """
-                    SELECT playerId from players where playerId IN %s
-                """
-                strPlayersIds = [str(playerId) for playerId in playersIds]
-                cur.execute(select_sql, (tuple(strPlayersIds),))
-                saved_players = cur.fetchall()
-                saved_players = [player[0] for player in saved_players]
-                players_to_insert = [player for player in strPlayersIds if player not in saved_players]
-                
-                if len(players_to_insert) > 0:
-                    save_players_to_db([Player(playerId=player).update_infos(gameDate) for player in players_to_insert])
+        with metrics.span('player bootstrap'):
+            # The connection goes back to the pool before the bootstrap requests
+            with unit_of_work() as conn:
+                with conn.cursor() as cur:
+                    select_sql = """
+                        SELECT playerId from players where playerId IN %s
+                    """
+                    cur.execute(select_sql, (tuple(playersIds),))
+                    saved_players = set(player[0] for player in cur.fetchall())
+
+            players_to_insert = [player for player in playersIds if player not in saved_players]
+            if len(players_to_insert) > 0:
+                save_players_to_db(bootstrap_players(players_to_insert, gameDate, gameType))
                 
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('player bootstrap', error)
 
-class PlayerGameLog:
-    def __init__(
-        self,
-        gameLogsId,
-        gameId,
-        playerId,
-        teamAbbrev,
-        homeRoadFlag,
-        gameDate,
-        goals,
-        assists,
-        points,
-        plusMinus,
-        powerPlayGoals,
-        powerPlayPoints,
-        gameWinningGoals,
-        otGoals,
-        shots,
-        shifts,
-        shortHandedGoals,
-        shortHandedPoints,
-        opponentAbbrev,
-        pim,
-        toi,
-        gameType,
-    ):
-        self.gameLogsId = gameLogsId
-        self.gameId = gameId
-        self.playerId = playerId
-        self.teamAbbrev = teamAbbrev
-        self.homeRoadFlag = homeRoadFlag
-        self.gameDate = gameDate
-        self.goals = goals
-        self.assists = assists
-        self.points = points
-        self.plusMinus = plusMinus
-        self.powerPlayGoals = powerPlayGoals
-        self.powerPlayPoints = powerPlayPoints
-        self.gameWinningGoals = gameWinningGoals
-        self.otGoals = otGoals
-        self.shots = shots
-        self.shifts = shifts
-        self.shortHandedGoals = shortHandedGoals
-        self.shortHandedPoints = shortHandedPoints
-        self.opponentAbbrev = opponentAbbrev
-        self.pim = pim
-        self.toi = toi
-        self.gameType = gameType
+PLAYER_GAMELOG_COLUMNS = (
+    'gameId',
+    'playerId',
+    'teamAbbrev',
+    'homeRoadFlag',
+    'gameDate',
+    'goals',
+    'assists',
+    'points',
+    'plusMinus',
+    'powerPlayGoals',
+    'powerPlayPoints',
+    'gameWinningGoals',
+    'otGoals',
+    'shots',
+    'shifts',
+    'shortHandedGoals',
+    'shortHandedPoints',
+    'opponentAbbrev',
+    'pim',
+    'toi',
+    'gameType',
+)
 
-    def values(self):
-        return (
-            self.gameLogsId,
-            self.gameId,
-            self.playerId,
-            self.teamAbbrev,
-            self.homeRoadFlag,
-            self.gameDate,
-            self.goals,
-            self.assists,
-            self.points,
-            self.plusMinus,
-            self.powerPlayGoals,
-            self.powerPlayPoints,
-            self.gameWinningGoals,
-            self.otGoals,
-            self.shots,
-            self.shifts,
-            self.shortHandedGoals,
-            self.shortHandedPoints,
-            self.opponentAbbrev,
-            self.pim,
-            self.toi,
-            self.gameType,
-        )
+class PlayerGameLog(Record):
+    __slots__ = PLAYER_GAMELOG_COLUMNS
 
 def save_player_gamelogs_to_db(playergamelogs):
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASSWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
-            with conn.cursor() as cur:
-                    gameLogsSql = ''' INSERT INTO gamelogs(
-                                        gameLogsId,                                
-                                        gameId, 
-                                        playerId, 
-                                        teamAbbrev, 
-                                        homeRoadFlag, 
-                                        gameDate, 
-                                        goals, 
-                                        assists, 
-                                        points, 
-                                        plusMinus, 
-                                        powerPlayGoals, 
-                                        powerPlayPoints, 
-                                        gameWinningGoals, 
-                                        otGoals, 
-                                        shots, 
-                                        shifts, 
-                                        shortHandedGoals, 
-                                        shortHandedPoints, 
-                                        opponentAbbrev, 
-                                        pim, 
-                                        toi, 
-                                        gameType
-                                    ) values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                                    ON CONFLICT (gameLogsId) DO UPDATE
-                                        SET gameId = excluded.gameId, 
-                                            playerId = excluded.playerId, 
-                                            teamAbbrev = excluded.teamAbbrev, 
-                                            homeRoadFlag = excluded.homeRoadFlag, 
-                                            gameDate = excluded.gameDate, 
-                                            goals = excluded.goals, 
-                                            assists = excluded.assists, 
-                                            points = excluded.points, 
-                                            plusMinus = excluded.plusMinus, 
-                                            powerPlayGoals = excluded.powerPlayGoals, 
-                                            powerPlayPoints = excluded.powerPlayPoints, 
-                                            gameWinningGoals = excluded.gameWinningGoals, 
-                                            otGoals = excluded.otGoals, 
-                                            shots = excluded.shots, 
-                                            shifts = excluded.shifts, 
-                                            shortHandedGoals = excluded.shortHandedGoals, 
-                                            shortHandedPoints = excluded.shortHandedPoints, 
-                                            opponentAbbrev = excluded.opponentAbbrev, 
-                                            pim = excluded.pim, 
-                                            toi = excluded.toi, 
-                                            gameType = excluded.gameType
-                                '''
-                    print('Saving ' + str(len(playergamelogs)) + ' game logs')
-                    cur.executemany(gameLogsSql, [playergamelog.values() for playergamelog in playergamelogs])
-                    print ('Done.')
+        with metrics.span('db write'), unit_of_work() as conn:
+            print('Saving ' + str(len(playergamelogs)) + ' game logs')
+            result = bulk_upsert(conn, 'gamelogs', PLAYER_GAMELOG_COLUMNS, ('gameId', 'playerId'), [playergamelog.values() for playergamelog in playergamelogs])
+            metrics.add_rows('gamelogs', result)
+            print('Done. ' + str(result))
+        return True
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        metrics.error('db write', error)
+        return False
 
-def fetch_player_log(playersBoxScore, game: Game, gameGoals, away: bool):
+def fetch_player_log(playersBoxScore, game: Game, scoringIndex: GameScoringIndex, away: bool):
     gamelogs = []
     playerIds = []
     for playerBoxScore in playersBoxScore:
         playerIds.append(playerBoxScore['playerId'])
         gamelogs.append(PlayerGameLog(
-            str(game.gameId) + str(playerBoxScore['playerId']),
             game.gameId,
             playerBoxScore['playerId'],
             game.awayTeamAbbrev if away else game.homeTeamAbbrev,
@@ -394,18 +246,18 @@ def fetch_player_log(playersBoxScore, game: Game, gameGoals, away: bool):
             playerBoxScore['points'],
             playerBoxScore['plusMinus'],
             playerBoxScore['powerPlayGoals'],
-            fetch_strength_points(playerBoxScore['playerId'], gameGoals, 'pp'),
-            0,#1 if 'winningGoalScorer' in game and game['winningGoalScorer']['playerId'] == playerBoxScore['playerId'] else 0, # TODO: GAME
-            0 if game.gameOutcome == 'REG' else fetch_ot_goals(playerBoxScore['playerId'], gameGoals),
+            scoringIndex.points(playerBoxScore['playerId'], 'pp'),
+            scoringIndex.game_winning_goals(playerBoxScore['playerId']),
+            0 if game.gameOutcome == 'REG' else scoringIndex.ot_goals(playerBoxScore['playerId']),
             playerBoxScore['shots'],
             0, # shifts
-            fetch_strength_points(playerBoxScore['playerId'], gameGoals, 'sh', True, False),
-            fetch_strength_points(playerBoxScore['playerId'], gameGoals, 'sh'),
+            scoringIndex.points(playerBoxScore['playerId'], 'sh', True, False),
+            scoringIndex.points(playerBoxScore['playerId'], 'sh'),
             game.homeTeamAbbrev if away else game.awayTeamAbbrev,
             playerBoxScore['pim'],
             playerBoxScore['toi'] if 'toi' in playerBoxScore else '00:00',
             game.gameType,
         ))
     
-    save_players_if_not_exists(playerIds, datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ'))
+    save_players_if_not_exists(playerIds, datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ'), game.gameType)
     return gamelogs
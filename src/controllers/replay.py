@@ -0,0 +1,64 @@
+import os
+import json
+import httpx
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# Where recorded fixtures go and where the stub server reads them from
+FIXTURES_DIR = os.environ.get("FIXTURES_DIR", "./data/fixtures")
+
+
+def canonical_url(url, params=None):
+    # The url httpx actually requests (False sent as false, None as an empty value), with its
+    # query parameters sorted, so the recorder and the stub server agree on the key of a request.
+    parts = urlsplit(str(httpx.Request('GET', url, params=params).url))
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    canonical = parts.scheme + '://' + parts.netloc + parts.path
+    if query:
+        canonical += '?' + urlencode(sorted(query))
+    return canonical
+
+
+def replay_url(url, replayBase):
+    # https://api-web.nhle.com/v1/... -> http://127.0.0.1:8765/api-web.nhle.com/v1/...
+    parts = urlsplit(url)
+    replayed = replayBase.rstrip('/') + '/' + parts.netloc + parts.path
+    if parts.query:
+        replayed += '?' + parts.query
+    return replayed
+
+
+def original_url(path):
+    # Inverse of replay_url for the path the stub server receives
+    return 'https://' + path.lstrip('/')
+
+
+class FixtureStore:
+    # One JSON file per request: url, status and body, named after the hash of the canonical url.
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def save(self, url, params, status, body):
+        url = canonical_url(url, params)
+        path = self.path(url)
+        tmpPath = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'url': url, 'status': status, 'body': body}, f)
+        with self.lock:
+            os.replace(tmpPath, path)
+
+    def load(self, url, params=None):
+        try:
+            with open(self.path(canonical_url(url, params)), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.directory) if name.endswith('.json')])
@@ -0,0 +1,174 @@
+import psycopg2
+from datetime import datetime
+from controllers.db import unit_of_work
+
+GAMELOG_TABLES = ('gamelogs', 'goalerGameLogs')
+
+GAMELOGS_SQL = '''
+    CREATE TABLE gamelogs (
+        gameId BIGINT NOT NULL,
+        playerId INTEGER NOT NULL,
+        teamAbbrev VARCHAR(10),
+        homeRoadFlag VARCHAR(1),
+        gameDate DATE,
+        goals INTEGER,
+        assists INTEGER,
+        points INTEGER,
+        plusMinus INTEGER,
+        powerPlayGoals INTEGER,
+        powerPlayPoints INTEGER,
+        gameWinningGoals INTEGER,
+        otGoals INTEGER,
+        shots INTEGER,
+        shifts INTEGER,
+        shorthandedGoals INTEGER,
+        shorthandedPoints INTEGER,
+        opponentAbbrev VARCHAR(10),
+        pim INTEGER,
+        toi INTERVAL,
+        gameType INTEGER,
+        PRIMARY KEY (gameId, playerId)
+    ) PARTITION BY RANGE (gameId)
+    '''
+
+GOALER_GAMELOGS_SQL = '''
+    CREATE TABLE goalerGameLogs (
+        gameId BIGINT NOT NULL,
+        playerId INTEGER NOT NULL,
+        teamAbbrev VARCHAR(3),
+        homeRoadFlag VARCHAR(1),
+        gameDate DATE,
+        goals INTEGER,
+        assists INTEGER,
+        gamesStarted INTEGER,
+        decision VARCHAR(10),
+        shotsAgainst INTEGER,
+        goalsAgainst INTEGER,
+        savePctg NUMERIC,
+        shutouts INTEGER,
+        opponentAbbrev VARCHAR(3),
+        pim INTEGER,
+        toi INTERVAL,
+        gameType INTEGER,
+        PRIMARY KEY (gameId, playerId)
+    ) PARTITION BY RANGE (gameId)
+    '''
+
+
+def create_season_partitions(cur, firstYear, lastYear):
+    # Game ids start with the season's first year (2023020001), so a season is the id range
+    # [2023000000, 2024000000). Anything outside the created seasons lands in the default partition.
+    for table in GAMELOG_TABLES:
+        for year in range(firstYear, lastYear + 1):
+            cur.execute(
+                'CREATE TABLE IF NOT EXISTS ' + table + '_' + str(year) + str(year + 1)
+                + ' PARTITION OF ' + table
+                + ' FOR VALUES FROM (' + str(year * 1000000) + ') TO (' + str((year + 1) * 1000000) + ')'
+            )
+        cur.execute('CREATE TABLE IF NOT EXISTS ' + table + '_default PARTITION OF ' + table + ' DEFAULT')
+
+
+def ensure_season_partitions(cur):
+    # The upcoming season gets its partition before its first game is stored.
+    year = datetime.now().year
+    create_season_partitions(cur, year - 1, year + 1)
+
+
+def migrate_1(cur):
+    # Integer ids, (gameId, playerId) natural key, season partitions and indexes for the gamelog tables.
+    cur.execute('SELECT min(left(gameId, 4)::INTEGER) FROM (SELECT gameId FROM gamelogs UNION ALL SELECT gameId FROM goalerGameLogs) logs')
+    firstYear = cur.fetchone()[0] or datetime.now().year - 10
+
+    for table in GAMELOG_TABLES:
+        cur.execute('ALTER TABLE ' + table + ' RENAME TO ' + table + '_v0')
+        # Frees the primary key index name for the new table
+        cur.execute('ALTER TABLE ' + table + '_v0 RENAME CONSTRAINT ' + table.lower() + '_pkey TO ' + table.lower() + '_v0_pkey')
+    cur.execute(GAMELOGS_SQL)
+    cur.execute(GOALER_GAMELOGS_SQL)
+    create_season_partitions(cur, firstYear, datetime.now().year + 1)
+
+    cur.execute('''
+        INSERT INTO gamelogs
+        SELECT gameId::BIGINT, playerId::INTEGER, teamAbbrev, homeRoadFlag, gameDate, goals, assists, points, plusMinus,
+            powerPlayGoals, powerPlayPoints, gameWinningGoals, otGoals, shots, shifts, shorthandedGoals, shorthandedPoints,
+            opponentAbbrev, pim, toi, gameType
+        FROM gamelogs_v0
+        ON CONFLICT DO NOTHING
+        ''')
+    cur.execute('''
+        INSERT INTO goalerGameLogs
+        SELECT gameId::BIGINT, playerId::INTEGER, teamAbbrev, homeRoadFlag, gameDate, goals, assists, gamesStarted, decision,
+            shotsAgainst, goalsAgainst, savePctg, shutouts, opponentAbbrev, pim, toi, gameType
+        FROM goalerGameLogs_v0
+        ON CONFLICT DO NOTHING
+        ''')
+    for table in GAMELOG_TABLES:
+        cur.execute('DROP TABLE ' + table + '_v0')
+
+    # Nothing references these ids anymore, they can change type in place
+    cur.execute('ALTER TABLE players ALTER COLUMN playerId TYPE INTEGER USING playerId::INTEGER')
+    cur.execute('ALTER TABLE goalers ALTER COLUMN playerId TYPE INTEGER USING playerId::INTEGER')
+    cur.execute('ALTER TABLE games ALTER COLUMN gameId TYPE BIGINT USING gameId::BIGINT')
+    cur.execute('ALTER TABLE IF EXISTS gameSyncState ALTER COLUMN gameId TYPE BIGINT USING gameId::BIGINT')
+    cur.execute('ALTER TABLE IF EXISTS poolPlayerPoints ALTER COLUMN playerId TYPE INTEGER USING playerId::INTEGER')
+
+    cur.execute('ALTER TABLE gamelogs ADD FOREIGN KEY (playerId) REFERENCES players (playerId)')
+    cur.execute('ALTER TABLE goalerGameLogs ADD FOREIGN KEY (playerId) REFERENCES goalers (playerId)')
+    cur.execute('ALTER TABLE goalerGameLogs ADD FOREIGN KEY (gameId) REFERENCES games (gameId)')
+    for table in GAMELOG_TABLES:
+        cur.execute('ALTER TABLE ' + table + ' ADD FOREIGN KEY (teamAbbrev) REFERENCES teams (abbrev)')
+        cur.execute('ALTER TABLE ' + table + ' ADD FOREIGN KEY (opponentAbbrev) REFERENCES teams (abbrev)')
+
+        # The primary key already serves gameId lookups
+        cur.execute('CREATE INDEX ' + table + '_playerId_gameDate ON ' + table + ' (playerId, gameDate)')
+        cur.execute('CREATE INDEX ' + table + '_gameDate ON ' + table + ' (gameDate)')
+        cur.execute('CREATE INDEX ' + table + '_teamAbbrev_gameDate ON ' + table + ' (teamAbbrev, gameDate)')
+
+    cur.execute('CREATE INDEX games_season ON games (season)')
+    cur.execute('CREATE INDEX games_startTimeUTC ON games (startTimeUTC)')
+
+
+def migrate_2(cur):
+    # Stored birth dates let age be recomputed in SQL, bioUpdatedAt lets the bio refresher skip fresh rows.
+    for table in ('players', 'goalers'):
+        cur.execute('ALTER TABLE ' + table + ' ADD COLUMN IF NOT EXISTS birthDate DATE, ADD COLUMN IF NOT EXISTS bioUpdatedAt TIMESTAMP')
+
+
+# (version, description, migration), applied in order, each in its own transaction
+MIGRATIONS = [
+    (1, 'integer ids, natural key, indexes and season partitions for gamelogs', migrate_1),
+    (2, 'birth date and bio refresh time for players and goalers', migrate_2),
+]
+
+
+def migrate():
+    # Brings a database created by init-db.py schema up to the latest version. Safe to run on every start.
+    # Any failure is raised, nothing should run against a half-migrated schema.
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS schemaMigrations (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(255),
+                    appliedAt TIMESTAMP
+                )
+                ''')
+            cur.execute('SELECT version FROM schemaMigrations')
+            applied = set(row[0] for row in cur.fetchall())
+
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        print('Migrating schema to version ' + str(version) + ': ' + description)
+        try:
+            with unit_of_work() as conn:
+                with conn.cursor() as cur:
+                    migration(cur)
+                    cur.execute('INSERT INTO schemaMigrations (version, description, appliedAt) VALUES (%s, %s, now())', (version, description))
+        except (psycopg2.DatabaseError, Exception):
+            print('Migration ' + str(version) + ' failed, schema left at the previous version')
+            raise
+
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            ensure_season_partitions(cur)
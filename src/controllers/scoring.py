@@ -0,0 +1,193 @@
+import numpy as np
+from controllers.db import unit_of_work
+from controllers.pool import Pool, POOL_COLUMNS
+
+# (category, pool weight column, gamelog SQL expression), the standings SQL is built from these too.
+# Hits are not in the boxscores we store yet, their column stays at 0.
+SKATER_CATEGORIES = (
+    ('goals', 'scoringGoals', 'COALESCE(g.goals, 0)'),
+    ('assists', 'scoringAssists', 'COALESCE(g.assists, 0)'),
+    ('powerPlayPoints', 'scoringPPP', 'COALESCE(g.powerPlayPoints, 0)'),
+    ('shortHandedPoints', 'scoringSHP', 'COALESCE(g.shortHandedPoints, 0)'),
+    ('shots', 'scoringSOG', 'COALESCE(g.shots, 0)'),
+    ('hits', 'scoringHits', '0'),
+)
+GOALIE_CATEGORIES = (
+    ('wins', 'scoringGoalieWins', "(decision = 'W')::INTEGER"),
+    ('losses', 'scoringGoalieLosses', "(decision = 'L')::INTEGER"),
+    ('saves', 'scoringGoalieSaves', 'COALESCE(shotsAgainst - goalsAgainst, 0)'),
+    ('shutouts', 'scoringGoalieShutouts', 'COALESCE(shutouts, 0)'),
+    ('otLosses', 'scoringGoalieOTL', "(decision = 'O')::INTEGER"),
+)
+
+# Position groups, index into POSITION_CAPS
+FORWARD = 0
+DEFENSE = 1
+GOALIE = 2
+
+# (games played cap column, roster slots column) of each position group
+POSITION_CAPS = (
+    ('forwardGamePlayed', 'forwards'),
+    ('defenseGamePlayed', 'defense'),
+    ('goalieGamePlayed', 'goalie'),
+)
+
+# Skater position group from the players row joined as p
+SKATER_GROUP_SQL = "CASE WHEN p.positionCode = 'D' THEN " + str(DEFENSE) + " ELSE " + str(FORWARD) + " END"
+
+SKATER_LOGS_SQL = '''
+    SELECT g.gameId, g.playerId, g.gameDate, ''' + SKATER_GROUP_SQL + ''',
+        ''' + ', '.join(expression for _, _, expression in SKATER_CATEGORIES) + '''
+    FROM gamelogs g
+    JOIN players p ON p.playerId = g.playerId
+    WHERE g.gameType = 2
+    '''
+
+GOALIE_LOGS_SQL = '''
+    SELECT gameId, playerId, gameDate, ''' + str(GOALIE) + ''',
+        ''' + ', '.join(expression for _, _, expression in GOALIE_CATEGORIES) + '''
+    FROM goalerGameLogs
+    WHERE gameType = 2
+    '''
+
+
+def category_columns_sql(categories, scored):
+    # One column per category named after its weight column, 0 for the categories not in scored,
+    # so the skater and goalie sides of a UNION line up
+    return ', '.join((category[2] if category in scored else '0') + ' AS ' + category[1] for category in categories)
+
+
+def pool_points_sql(pool, logs, categories):
+    # Sum of the category columns of logs times the weights of pool, a missing weight scores nothing
+    return ' + '.join(logs + '.' + weight + ' * COALESCE(' + pool + '.' + weight + ', 0)' for _, weight, _ in categories)
+
+
+def games_cap_sql(pool, group):
+    # games_cap of pool for the position group in the group column, NULL when there is no cap
+    return 'CASE ' + group + ' ' + ' '.join(
+        'WHEN ' + str(i) + ' THEN CASE WHEN ' + pool + '.' + gamePlayed + ' > 0 AND ' + pool + '.' + slots + ' > 0'
+        + ' THEN ceil(' + pool + '.' + gamePlayed + '::NUMERIC / ' + pool + '.' + slots + ') END'
+        for i, (gamePlayed, slots) in enumerate(POSITION_CAPS)
+    ) + ' END'
+
+
+class GameLogArrays:
+    # One regular season gamelog per row, stats as a (logs x categories) float matrix.
+    def __init__(self, rows, categoryCount):
+        self.gameId = np.array([row[0] for row in rows], dtype=np.int64)
+        self.playerId = np.array([row[1] for row in rows], dtype=np.int64)
+        self.gameDate = np.array([row[2] for row in rows], dtype='datetime64[D]')
+        self.group = np.array([row[3] for row in rows], dtype=np.int8)
+        self.stats = np.array([row[4:] for row in rows], dtype=np.float64).reshape(len(rows), categoryCount)
+        # 2023020001 -> 20232024, the same format as pools.season
+        year = self.gameId // 1000000
+        self.season = year * 10000 + year + 1
+        self.gameNumber = game_numbers(self.playerId, self.season, self.gameDate, self.gameId)
+
+    def __len__(self):
+        return len(self.gameId)
+
+
+def game_numbers(playerIds, seasons, gameDates, gameIds):
+    # 1-based rank of each log among its player's games of the season, in date order.
+    order = np.lexsort((gameIds, gameDates, seasons, playerIds))
+    if len(order) == 0:
+        return np.zeros(0, dtype=np.int64)
+    sortedPlayers = playerIds[order]
+    sortedSeasons = seasons[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (sortedPlayers[1:] != sortedPlayers[:-1]) | (sortedSeasons[1:] != sortedSeasons[:-1])
+    positions = np.arange(len(order))
+    groupStart = np.maximum.accumulate(np.where(starts, positions, 0))
+    numbers = np.empty(len(order), dtype=np.int64)
+    numbers[order] = positions - groupStart + 1
+    return numbers
+
+
+def load_pools():
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT ' + ', '.join(POOL_COLUMNS) + ' FROM pools')
+            return [Pool(*row) for row in cur.fetchall()]
+
+
+def load_skater_logs():
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SKATER_LOGS_SQL)
+            return GameLogArrays(cur.fetchall(), len(SKATER_CATEGORIES))
+
+
+def load_goalie_logs():
+    with unit_of_work() as conn:
+        with conn.cursor() as cur:
+            cur.execute(GOALIE_LOGS_SQL)
+            return GameLogArrays(cur.fetchall(), len(GOALIE_CATEGORIES))
+
+
+def weights_matrix(pools, categories):
+    # (categories x pools), a missing weight scores nothing
+    return np.array([[float(getattr(pool, weight) or 0) for pool in pools] for _, weight, _ in categories], dtype=np.float64).reshape(len(categories), len(pools))
+
+
+def games_cap(gamePlayed, slots):
+    # The pool caps games played for a whole position group, e.g. 738 for 9 forwards.
+    # Without rosters each player gets an even share of it, 0 means no cap.
+    gamePlayed = gamePlayed or 0
+    slots = slots or 0
+    if gamePlayed <= 0 or slots <= 0:
+        return np.inf
+    return np.ceil(gamePlayed / slots)
+
+
+def caps_matrix(pools):
+    # (position groups x pools) max number of games a player scores in
+    return np.array([
+        [games_cap(getattr(pool, gamePlayed), getattr(pool, slots)) for pool in pools]
+        for gamePlayed, slots in POSITION_CAPS
+    ], dtype=np.float64).reshape(len(POSITION_CAPS), len(pools))
+
+
+def score_logs(logs: GameLogArrays, pools, categories):
+    # (logs x pools) fantasy points: one matrix multiply, then the logs outside
+    # of the pool's season or past the player's games cap are zeroed.
+    points = logs.stats @ weights_matrix(pools, categories)
+    poolSeasons = np.array([int(pool.season) for pool in pools], dtype=np.int64)
+    counted = logs.season[:, None] == poolSeasons[None, :]
+    counted &= logs.gameNumber[:, None] <= caps_matrix(pools)[logs.group]
+    return points * counted
+
+
+def player_totals(logs: GameLogArrays, points):
+    # Sums a (logs x pools) points matrix into (players x pools), returns (playerIds, totals).
+    if len(logs) == 0:
+        return logs.playerId, points
+    order = np.argsort(logs.playerId, kind='stable')
+    sortedPlayers = logs.playerId[order]
+    starts = np.flatnonzero(np.r_[True, sortedPlayers[1:] != sortedPlayers[:-1]])
+    return sortedPlayers[starts], np.add.reduceat(points[order], starts, axis=0)
+
+
+class PoolScores:
+    def __init__(self, pools, skaterLogs: GameLogArrays, goalieLogs: GameLogArrays):
+        self.pools = pools
+        self.poolIds = [pool.poolId for pool in pools]
+        self.skaterLogs = skaterLogs
+        self.goalieLogs = goalieLogs
+        self.skaterPoints = score_logs(skaterLogs, pools, SKATER_CATEGORIES)
+        self.goaliePoints = score_logs(goalieLogs, pools, GOALIE_CATEGORIES)
+
+    def skater_totals(self):
+        return player_totals(self.skaterLogs, self.skaterPoints)
+
+    def goalie_totals(self):
+        return player_totals(self.goalieLogs, self.goaliePoints)
+
+
+def score_pools(pools = None, skaterLogs = None, goalieLogs = None):
+    # Rescores every pool over every stored regular season game, anything not given is loaded from the database.
+    return PoolScores(
+        pools if pools is not None else load_pools(),
+        skaterLogs if skaterLogs is not None else load_skater_logs(),
+        goalieLogs if goalieLogs is not None else load_goalie_logs(),
+    )
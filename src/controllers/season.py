@@ -1,10 +1,77 @@
-from nhlpy import NHLClient
+import os
+import json
+import bisect
+import threading
 from datetime import datetime
+from controllers.api import client
 
-client = NHLClient()
+SEASON_CACHE_PATH = os.environ.get("SEASON_CACHE_PATH", "./data/seasons.json")
+
+
+class SeasonCalendar:
+    # Season boundaries loaded once from the schedule API and kept on disk.
+    # startDate/endDate cover every date the API has mapped to the season, off-season included.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seasons = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.seasons = json.load(f)
+        self.index()
+
+    def index(self):
+        self.sorted = sorted(self.seasons.values(), key=lambda season: season['startDate'])
+        self.starts = [season['startDate'] for season in self.sorted]
+
+    def find(self, day):
+        i = bisect.bisect_right(self.starts, day) - 1
+        if i >= 0 and day <= self.sorted[i]['endDate']:
+            return self.sorted[i]['season']
+        return None
+
+    def get(self, date: datetime):
+        day = date.strftime('%Y-%m-%d')
+        with self.lock:
+            season = self.find(day)
+        if season is not None:
+            return season
+
+        schedule = client.schedule.get_schedule(day)
+        year = datetime.strptime(schedule["preSeasonStartDate"], "%Y-%m-%d").year
+        season = str(year) + str(year + 1)
+
+        with self.lock:
+            known = self.seasons.get(season, {
+                'season': season,
+                'startDate': schedule["preSeasonStartDate"],
+                'endDate': schedule["playoffEndDate"],
+            })
+            known['preSeasonStartDate'] = schedule["preSeasonStartDate"]
+            known['regularSeasonEndDate'] = schedule["regularSeasonEndDate"]
+            known['playoffEndDate'] = schedule["playoffEndDate"]
+            known['startDate'] = min(known['startDate'], schedule["preSeasonStartDate"], day)
+            known['endDate'] = max(known['endDate'], schedule["playoffEndDate"], day)
+            self.seasons[season] = known
+            self.index()
+            self.save()
+        return season
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.seasons, f, indent=2)
+        except OSError as error:
+            print('Cannot save season calendar: ' + str(error))
+
+
+calendar = SeasonCalendar(SEASON_CACHE_PATH)
 
 
 def get_season_from_date(date: datetime):
-    schedule = client.schedule.get_schedule(date.strftime('%Y-%m-%d'))
-    year = datetime.strptime(schedule["preSeasonStartDate"], "%Y-%m-%d").year
-    return str(year) + str(year + 1)
+    return calendar.get(date)
+
+
+def season_cayenne(season, gameType, playerIds):
+    # default_cayenne_exp replaces nhlpy's whole season filter, so the season and game type go in it too
+    return 'seasonId=' + str(season) + ' and gameTypeId=' + str(gameType) + ' and playerId in (' + ','.join(str(playerId) for playerId in playerIds) + ')'
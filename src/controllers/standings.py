@@ -0,0 +1,133 @@
+import psycopg2
+import traceback
+from datetime import datetime, timedelta
+from controllers.db import unit_of_work
+from controllers.scoring import SKATER_CATEGORIES, GOALIE_CATEGORIES, GOALIE, SKATER_GROUP_SQL, category_columns_sql, pool_points_sql, games_cap_sql
+
+
+def createStandingsTable():
+    # One row per pool, player and period. grain is 'day', 'week' or 'season', period is the
+    # game date, the monday of the week or pools.season, so dashboards only read the grain they show.
+    sql = '''
+        CREATE TABLE IF NOT EXISTS poolPlayerPoints (
+            poolId VARCHAR(100),
+            grain VARCHAR(10),
+            period VARCHAR(10),
+            playerId INTEGER,
+            games INTEGER,
+            goals INTEGER,
+            assists INTEGER,
+            points INTEGER,
+            poolPoints NUMERIC,
+            PRIMARY KEY (poolId, grain, period, playerId)
+        )
+        '''
+    try:
+        with unit_of_work() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+
+
+# Regular season skater and goalie logs of one day, scored with the weights of the pool of their season.
+# Categories, weights and games played caps come from controllers.scoring. A log past the player's cap
+# scores 0, the player's earlier games of the season are counted from the day rollup itself.
+CATEGORIES = SKATER_CATEGORIES + GOALIE_CATEGORIES
+
+REFRESH_DAY_SQL = '''
+    WITH logs AS (
+        SELECT g.gameId, g.playerId, g.gameDate, ''' + SKATER_GROUP_SQL + ''' AS positionGroup,
+            COALESCE(g.goals, 0) AS goals, COALESCE(g.assists, 0) AS assists,
+            ''' + category_columns_sql(CATEGORIES, SKATER_CATEGORIES) + '''
+        FROM gamelogs g
+        JOIN players p ON p.playerId = g.playerId
+        WHERE g.gameDate = %(day)s AND g.gameType = 2
+        UNION ALL
+        SELECT gameId, playerId, gameDate, ''' + str(GOALIE) + ''',
+            COALESCE(goals, 0), COALESCE(assists, 0),
+            ''' + category_columns_sql(CATEGORIES, GOALIE_CATEGORIES) + '''
+        FROM goalerGameLogs
+        WHERE gameDate = %(day)s AND gameType = 2
+    ),
+    scored AS (
+        SELECT pl.poolId, l.playerId, l.goals, l.assists,
+            ''' + pool_points_sql('pl', 'l', CATEGORIES) + ''' AS poolPoints,
+            ''' + games_cap_sql('pl', 'l.positionGroup') + ''' AS gamesCap,
+            COALESCE(prior.games, 0) + row_number() OVER (PARTITION BY pl.poolId, l.playerId ORDER BY l.gameId) AS gameNumber
+        FROM logs l
+        JOIN pools pl ON pl.season = (l.gameId / 1000000)::TEXT || (l.gameId / 1000000 + 1)::TEXT
+        LEFT JOIN LATERAL (
+            SELECT sum(r.games) AS games
+            FROM poolPlayerPoints r
+            WHERE r.poolId = pl.poolId AND r.grain = 'day' AND r.playerId = l.playerId AND r.period < %(day)s
+        ) prior ON TRUE
+    )
+    INSERT INTO poolPlayerPoints (poolId, grain, period, playerId, games, goals, assists, points, poolPoints)
+    SELECT poolId, 'day', %(day)s, playerId, count(*), sum(goals), sum(assists), sum(goals + assists),
+        sum(CASE WHEN gamesCap IS NULL OR gameNumber <= gamesCap THEN poolPoints ELSE 0 END)
+    FROM scored
+    GROUP BY poolId, playerId
+    '''
+
+# Weeks and seasons are summed from the day rollup, never from the gamelogs.
+REFRESH_WEEK_SQL = '''
+    INSERT INTO poolPlayerPoints (poolId, grain, period, playerId, games, goals, assists, points, poolPoints)
+    SELECT poolId, 'week', %(week)s, playerId, sum(games), sum(goals), sum(assists), sum(points), sum(poolPoints)
+    FROM poolPlayerPoints
+    WHERE grain = 'day' AND period >= %(week)s AND period < %(nextWeek)s
+    GROUP BY poolId, playerId
+    '''
+
+REFRESH_SEASON_SQL = '''
+    INSERT INTO poolPlayerPoints (poolId, grain, period, playerId, games, goals, assists, points, poolPoints)
+    SELECT r.poolId, 'season', pl.season, r.playerId, sum(r.games), sum(r.goals), sum(r.assists), sum(r.points), sum(r.poolPoints)
+    FROM poolPlayerPoints r
+    JOIN pools pl USING (poolId)
+    WHERE r.grain = 'day' AND pl.season = %(season)s
+    GROUP BY r.poolId, pl.season, r.playerId
+    '''
+
+SEASONS_OF_DAY_SQL = '''
+    SELECT DISTINCT pl.season
+    FROM poolPlayerPoints r
+    JOIN pools pl USING (poolId)
+    WHERE r.grain = 'day' AND r.period = %s
+    '''
+
+
+def refresh_standings(gameDates):
+    # Rebuilds the day, week and season rollups touched by the given game dates only.
+    # Days go oldest first so each one sees the games played before it.
+    days = sorted(set(gameDate.strftime('%Y-%m-%d') if hasattr(gameDate, 'strftime') else str(gameDate)[:10] for gameDate in gameDates))
+    if len(days) == 0:
+        return
+
+    try:
+        with unit_of_work() as conn:
+            with conn.cursor() as cur:
+                weeks = set()
+                seasons = set()
+                for day in days:
+                    # Seasons of the day before and after its refresh, in case all of its logs are gone
+                    cur.execute(SEASONS_OF_DAY_SQL, (day,))
+                    seasons.update(row[0] for row in cur.fetchall())
+                    cur.execute("DELETE FROM poolPlayerPoints WHERE grain = 'day' AND period = %s", (day,))
+                    cur.execute(REFRESH_DAY_SQL, {'day': day})
+                    cur.execute(SEASONS_OF_DAY_SQL, (day,))
+                    seasons.update(row[0] for row in cur.fetchall())
+                    date = datetime.strptime(day, '%Y-%m-%d')
+                    monday = date - timedelta(days=date.weekday())
+                    weeks.add((monday.strftime('%Y-%m-%d'), (monday + timedelta(days=7)).strftime('%Y-%m-%d')))
+
+                for week, nextWeek in sorted(weeks):
+                    cur.execute("DELETE FROM poolPlayerPoints WHERE grain = 'week' AND period = %s", (week,))
+                    cur.execute(REFRESH_WEEK_SQL, {'week': week, 'nextWeek': nextWeek})
+
+                for season in sorted(seasons):
+                    cur.execute("DELETE FROM poolPlayerPoints WHERE grain = 'season' AND period = %s", (season,))
+                    cur.execute(REFRESH_SEASON_SQL, {'season': season})
+
+        print('Refreshed standings of ' + str(len(days)) + ' days, ' + str(len(weeks)) + ' weeks, ' + str(len(seasons)) + ' seasons')
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
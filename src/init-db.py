@@ -1,14 +1,24 @@
 import os
-import requests
 import psycopg2
 import json
-from nhlpy import NHLClient
+import argparse
 from datetime import datetime
 import traceback
+from controllers.api import client, governor
+from controllers.db import unit_of_work, bulk_upsert
+from controllers.game import GAME_COLUMNS, Game, get_season_games
+from controllers.player import PLAYER_COLUMNS, PLAYER_GAMELOG_COLUMNS, PlayerGameLog
+from controllers.goaler import GOALER_COLUMNS, GOALER_GAMELOG_COLUMNS, GoalerGameLog
+from controllers.boxscore import fetch_game_logs
+from controllers.backfill import run_backfill, BACKFILL_WORKERS
 from controllers.pool import Pool, createPoolTable, insertPools
+from controllers.standings import createStandingsTable, refresh_standings
+from controllers.schema import migrate
+from controllers.bio import refresh_bios
 
 
 def generate_db():
+    # Baseline schema, controllers.schema migrates it to the current version.
 
     commands = [
         '''
@@ -185,11 +195,7 @@ def generate_db():
     ]
 
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
                 # execute the CREATE TABLE statement
                 for command in commands:
@@ -214,453 +220,332 @@ def insertTeams():
 
     print(franchises_data)
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                sql = 'INSERT INTO teams(id, fullName, commonName, placeName, abbrev) values(%s, %s, %s, %s, %s) RETURNING *'
+                sql = 'INSERT INTO teams(id, fullName, commonName, placeName, abbrev) values(%s, %s, %s, %s, %s)'
                 result = cur.executemany(sql, franchises_data)
     except (psycopg2.DatabaseError, Exception) as error:
         print(error)
 
 def insertPlayers(start_season, end_season):
-    client = NHLClient()
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                for i in range(start_season, end_season):
-                    current = i+1 == datetime.now().year
-                    insert_sql = 'INSERT INTO players(playerId, fullName, positionCode, teamAbbrev) values(%s,%s,%s,%s) RETURNING *'
-
-                    # We want all stats for current season
-                    if current:
-                        insert_sql = '''
-                            INSERT INTO players(
-
-                            ) values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                            RETURNING *
-                        '''
-
-                    season = str(i) + str(i + 1)
-                    print('fetching season ' + season)
-                    players = client.stats.skater_stats_summary_simple(start_season=season, end_season=season, limit=-1)
-
-                    print('got ' + str(len(players)) + ' players')
-                    players_db = []
-
-                    for player in players:
-                        # Check if player already exists
-                        sql = 'SELECT 1 FROM players WHERE playerId = %s'
-                        cur.execute(sql, (str(player['playerId']),))
-
-                        if(cur.fetchone() is None):
-                            if current:
-                                players_db.append((
-                                    player['playerId'],
-                                    player['skaterFullName'],
-                                    player['goals'],
-                                    player['assists'],
-                                    player['evGoals'],
-                                    player['evPoints'],
-                                    player['faceoffWinPct'],
-                                    player['gameWinningGoals'],
-                                    player['gamesPlayed'],
-                                    player['otGoals'],
-                                    player['penaltyMinutes'],
-                                    player['plusMinus'],
-                                    player['points'],
-                                    player['pointsPerGame'],
-                                    player['positionCode'],
-                                    player['ppGoals'],
-                                    player['ppPoints'],
-                                    player['shGoals'],
-                                    player['shPoints'],
-                                    player['shootingPct'],
-                                    player['shootsCatches'],
-                                    player['shots'],
-                                    player['teamAbbrevs'][len(player['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
-                                    player['timeOnIcePerGame']
-                                ))
-                            else:
-                                players_db.append((
-                                    player['playerId'],
-                                    player['skaterFullName'],
-                                    player['positionCode'],
-                                    player['teamAbbrevs'][len(player['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
-                                ))
-
-                    if(len(players_db) > 0):
-                        print('inserting ' + str(len(players_db)) + ' players')
-                        # insert query
-                        cur.executemany(insert_sql, players_db)
-                        conn.commit()
-                    else:
-                        print('nothing to insert')
+                cur.execute('SELECT playerId FROM players')
+                saved_players = set(player[0] for player in cur.fetchall())
+
+        for i in range(start_season, end_season):
+            current = i+1 == datetime.now().year
+            columns = ('playerId', 'fullName', 'positionCode', 'teamAbbrev')
+
+            # We want all stats for current season
+            if current:
+                columns = PLAYER_COLUMNS[:PLAYER_COLUMNS.index('timeOnIcePerGame') + 1]
+
+            season = str(i) + str(i + 1)
+            print('fetching season ' + season)
+            players = client.stats.skater_stats_summary_simple(start_season=season, end_season=season, limit=-1)
+
+            print('got ' + str(len(players)) + ' players')
+            players_db = []
+
+            for player in players:
+                # Skip players already saved
+                if player['playerId'] in saved_players:
+                    continue
+                saved_players.add(player['playerId'])
+
+                if current:
+                    players_db.append((
+                        player['playerId'],
+                        player['skaterFullName'],
+                        player['goals'],
+                        player['assists'],
+                        player['evGoals'],
+                        player['evPoints'],
+                        player['faceoffWinPct'],
+                        player['gameWinningGoals'],
+                        player['gamesPlayed'],
+                        player['otGoals'],
+                        player['penaltyMinutes'],
+                        player['plusMinus'],
+                        player['points'],
+                        player['pointsPerGame'],
+                        player['positionCode'],
+                        player['ppGoals'],
+                        player['ppPoints'],
+                        player['shGoals'],
+                        player['shPoints'],
+                        player['shootingPct'],
+                        player['shootsCatches'],
+                        player['shots'],
+                        player['teamAbbrevs'][len(player['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
+                        player['timeOnIcePerGame']
+                    ))
+                else:
+                    players_db.append((
+                        player['playerId'],
+                        player['skaterFullName'],
+                        player['positionCode'],
+                        player['teamAbbrevs'][len(player['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
+                    ))
+
+            if(len(players_db) > 0):
+                print('inserting ' + str(len(players_db)) + ' players')
+                with unit_of_work() as conn:
+                    bulk_upsert(conn, 'players', columns, ('playerId',), players_db, False)
+            else:
+                print('nothing to insert')
 
     except (psycopg2.DatabaseError, Exception) as error:
         print(error)
 
 def insertGoalers(start_season, end_season):
-    client = NHLClient()
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                for i in range(start_season, end_season):
-                    current = i+1 == datetime.now().year
-                    insert_sql = 'INSERT INTO goalers(playerId, fullName, shootsCatches, teamAbbrev) values(%s,%s,%s,%s) RETURNING *'
-
-                    # We want all stats for current season
-                    if current:
-                        insert_sql = '''
-                            INSERT INTO goalers values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                            RETURNING *
-                        '''
-
-                    season = str(i) + str(i + 1)
-                    print('fetching season ' + season)
-                    goalers = client.stats.goalie_stats_summary_simple(start_season=season, end_season=season, limit=-1)
-
-                    print('got ' + str(len(goalers)) + ' goalers')
-                    players_db = []
-
-                    for goaler in goalers:
-                        # Check if player already exists
-                        sql = 'SELECT 1 FROM goalers WHERE playerId = %s'
-                        cur.execute(sql, (str(goaler['playerId']),))
-
-                        if(cur.fetchone() is None):
-                            if current:
-                                players_db.append((
-                                    goaler['playerId'],
-                                    goaler['goalieFullName'],
-                                    goaler['assists'], 
-                                    goaler['gamesPlayed'], 
-                                    goaler['gamesStarted'], 
-                                    goaler['goals'], 
-                                    goaler['goalsAgainst'], 
-                                    goaler['goalsAgainstAverage'], 
-                                    goaler['losses'], 
-                                    goaler['otLosses'], 
-                                    goaler['penaltyMinutes'], 
-                                    goaler['points'], 
-                                    goaler['savePct'], 
-                                    goaler['saves'], 
-                                    goaler['shootsCatches'],
-                                    goaler['shotsAgainst'], 
-                                    goaler['shutouts'], 
-                                    goaler['teamAbbrevs'][len(goaler['teamAbbrevs']) - 3:], # keep the last 3 for most recent team                                    
-                                    goaler['ties'], 
-                                    goaler['timeOnIce'], 
-                                    goaler['wins'], 
-                                ))
-                            else:
-                                players_db.append((
-                                    goaler['playerId'],
-                                    goaler['goalieFullName'],
-                                    goaler['shootsCatches'],
-                                    goaler['teamAbbrevs'][len(goaler['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
-                                ))
-
-                    if(len(players_db) > 0):
-                        print('inserting ' + str(len(players_db)) + ' goalers')
-                        # insert query
-                        cur.executemany(insert_sql, players_db)
-                        conn.commit()
-                    else:
-                        print('nothing to insert')
+                cur.execute('SELECT playerId FROM goalers')
+                saved_goalers = set(goaler[0] for goaler in cur.fetchall())
+
+        for i in range(start_season, end_season):
+            current = i+1 == datetime.now().year
+            columns = ('playerId', 'fullName', 'shootsCatches', 'teamAbbrev')
+
+            # We want all stats for current season
+            if current:
+                columns = GOALER_COLUMNS[:GOALER_COLUMNS.index('wins') + 1]
+
+            season = str(i) + str(i + 1)
+            print('fetching season ' + season)
+            goalers = client.stats.goalie_stats_summary_simple(start_season=season, end_season=season, limit=-1)
+
+            print('got ' + str(len(goalers)) + ' goalers')
+            players_db = []
+
+            for goaler in goalers:
+                # Skip goalers already saved
+                if goaler['playerId'] in saved_goalers:
+                    continue
+                saved_goalers.add(goaler['playerId'])
+
+                if current:
+                    players_db.append((
+                        goaler['playerId'],
+                        goaler['goalieFullName'],
+                        goaler['assists'], 
+                        goaler['gamesPlayed'], 
+                        goaler['gamesStarted'], 
+                        goaler['goals'], 
+                        goaler['goalsAgainst'], 
+                        goaler['goalsAgainstAverage'], 
+                        goaler['losses'], 
+                        goaler['otLosses'], 
+                        goaler['penaltyMinutes'], 
+                        goaler['points'], 
+                        goaler['savePct'], 
+                        goaler['saves'], 
+                        goaler['shootsCatches'],
+                        goaler['shotsAgainst'], 
+                        goaler['shutouts'], 
+                        goaler['teamAbbrevs'][len(goaler['teamAbbrevs']) - 3:], # keep the last 3 for most recent team                                    
+                        goaler['ties'], 
+                        goaler['timeOnIce'], 
+                        goaler['wins'], 
+                    ))
+                else:
+                    players_db.append((
+                        goaler['playerId'],
+                        goaler['goalieFullName'],
+                        goaler['shootsCatches'],
+                        goaler['teamAbbrevs'][len(goaler['teamAbbrevs']) - 3:], # keep the last 3 for most recent team
+                    ))
+
+            if(len(players_db) > 0):
+                print('inserting ' + str(len(players_db)) + ' goalers')
+                with unit_of_work() as conn:
+                    bulk_upsert(conn, 'goalers', columns, ('playerId',), players_db, False)
+            else:
+                print('nothing to insert')
 
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
 
-def insertGameLogs(start_season, end_season):
-    client = NHLClient()
+def player_game_log_row(playerId, game_log, game_type):
+    return (
+        game_log['gameId'],
+        playerId,
+        game_log['teamAbbrev'],
+        game_log['homeRoadFlag'],
+        game_log['gameDate'],
+        game_log['goals'],
+        game_log['assists'],
+        game_log['points'],
+        game_log['plusMinus'],
+        game_log['powerPlayGoals'],
+        game_log['powerPlayPoints'],
+        game_log['gameWinningGoals'],
+        game_log['otGoals'],
+        game_log['shots'],
+        game_log['shifts'],
+        game_log['shorthandedGoals'],
+        game_log['shorthandedPoints'],
+        game_log['opponentAbbrev'],
+        game_log['pim'],
+        game_log['toi'],
+        game_type
+    )
+
+def insertGameLogs(start_season, end_season, workers = BACKFILL_WORKERS):
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                select_sql = 'SELECT playerId from players'
-                cur.execute(select_sql)
+                cur.execute('SELECT playerId from players')
                 players = cur.fetchall()
-                index = 0
-                for player in players:
-                    for i in range(start_season, end_season):
-                        insert_sql = ''' INSERT INTO gamelogs(
-                                            gameLogsId                                
-                                            gameId, 
-                                            playerId, 
-                                            teamAbbrev, 
-                                            homeRoadFlag, 
-                                            gameDate, 
-                                            goals, 
-                                            assists, 
-                                            points, 
-                                            plusMinus, 
-                                            powerPlayGoals, 
-                                            powerPlayPoints, 
-                                            gameWinningGoals, 
-                                            otGoals, 
-                                            shots, 
-                                            shifts, 
-                                            shortHandedGoals, 
-                                            shortHandedPoints, 
-                                            opponentAbbrev, 
-                                            pim, 
-                                            toi, 
-                                            gameType
-                                        ) values(%s, %s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                                        RETURNING *
-                                    '''
-                        season = str(i) + str(i + 1)
-                        game_logs_db = []
-
-                        for game_type in range(1,4):
-                            try:
-                                game_logs = client.stats.player_game_log(player_id=player[0], season_id=season, game_type=game_type)
-                                for game_log in game_logs:
-                                    # Check if player already exists
-                                    sql = 'SELECT 1 FROM gamelogs WHERE playerId = %s AND gameId = %s'
-                                    cur.execute(sql, (str(player[0]), str(game_log['gameId'])))
-                                    if(cur.fetchone() is None):
-                                        game_logs_db.append((
-                                            game_log['gameId'] + player[0],
-                                            game_log['gameId'],
-                                            player[0],
-                                            game_log['teamAbbrev'],
-                                            game_log['homeRoadFlag'],
-                                            game_log['gameDate'],
-                                            game_log['goals'],
-                                            game_log['assists'],
-                                            game_log['points'],
-                                            game_log['plusMinus'],
-                                            game_log['powerPlayGoals'],
-                                            game_log['powerPlayPoints'],
-                                            game_log['gameWinningGoals'],
-                                            game_log['otGoals'],
-                                            game_log['shots'],
-                                            game_log['shifts'],
-                                            game_log['shorthandedGoals'],
-                                            game_log['shorthandedPoints'],
-                                            game_log['opponentAbbrev'],
-                                            game_log['pim'],
-                                            game_log['toi'],
-                                            game_type
-                                        ))
-                            except(KeyError) as error:
-                                yes = True
-                                print('Cannot get game logs for player ' + player[0])
-                                print(error)
-                        
-                        if(len(game_logs_db) > 0):
-                            print('inserting ' + str(len(game_logs_db)) + ' gameLogs')
-                            # insert query
-                            cur.executemany(insert_sql, game_logs_db)
-                            conn.commit()
-
-                    print(str(index) + '/' + str(len(players)) + ' players')
-                    index += 1
+                cur.execute('SELECT playerId, gameId FROM gamelogs')
+                saved_game_logs = set(cur.fetchall())
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
-
-def insertGames(start_season, end_season):
-    client = NHLClient()
+        return
+
+    def fetch(unit):
+        playerId, season, game_type = unit
+        try:
+            game_logs = client.stats.player_game_log(player_id=playerId, season_id=season, game_type=game_type)
+        except(KeyError) as error:
+            print('Cannot get game logs for player ' + str(playerId))
+            print(error)
+            return []
+        # Skip game logs already saved
+        return [player_game_log_row(playerId, game_log, game_type) for game_log in game_logs if (playerId, game_log['gameId']) not in saved_game_logs]
+
+    def save(conn, game_logs_db):
+        bulk_upsert(conn, 'gamelogs', PLAYER_GAMELOG_COLUMNS, ('gameId', 'playerId'), game_logs_db, False)
+
+    units = [(player[0], str(i) + str(i + 1), game_type) for player in players for i in range(start_season, end_season) for game_type in range(1,4)]
+    run_backfill('gamelogs', units, fetch, save, workers)
+
+def insertGames(start_season, end_season, workers = BACKFILL_WORKERS):
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                select_sql = 'SELECT abbrev from teams'
-                cur.execute(select_sql)
-                teams = cur.fetchall()
-                index = 0
-                for team in teams:
-                    for i in range(start_season, end_season):
-                        insert_sql = ''' INSERT INTO games(                                
-                                            gameId,
-                                            season,
-                                            gameType,
-                                            startTimeUTC,
-                                            venue,
-                                            awayTeamAbbrev,
-                                            awayTeamScore,
-                                            homeTeamAbbrev,
-                                            homeTeamScore,
-                                            gameOutcome,
-                                            recapLink,
-                                            gameCenterLink
-                                        ) values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                                        RETURNING *
-                                    '''
-                        season = str(i) + str(i + 1)
-                        games_db = []
-
-                        try:
-                            games = client.schedule.get_season_schedule(team[0], season)
-
-                            if 'games' not in games:
-                                print('No games for team ' + team[0] + ' for season ' + season)
-                                continue
-                            
-                            for game in games['games']:
-
-                                # Check if game already exists
-                                sql = 'SELECT 1 FROM games WHERE gameId = %s'
-                                cur.execute(sql, (str(game['id']),))
-                                if(cur.fetchone() is None):
-                                    games_db.append((
-                                        game['id'],
-                                        game['season'],
-                                        game['gameType'],
-                                        game['startTimeUTC'],
-                                        game['venue']['default'],
-                                        game['awayTeam']['abbrev'],
-                                        game['awayTeam']['score'] if game['gameScheduleState'] != 'CNCL' else 0,
-                                        game['homeTeam']['abbrev'],
-                                        game['homeTeam']['score'] if game['gameScheduleState'] != 'CNCL' else 0,
-                                        game['gameOutcome']['lastPeriodType'] if game['gameScheduleState'] != 'CNCL' else 'CANCELED',
-                                        'https://nhl.com/' + game['threeMinRecap'] if 'threeMinRecap' in game else "",
-                                        'https://nhl.com/' + game['gameCenterLink'] if 'gameCenterLink' in game else ""
-                                    ))
-
-                        except Exception as error:
-                            yes = True
-                            print('Cannot get games for team ' + team[0])
-                            traceback.print_exc()
-                        
-                        if(len(games_db) > 0):
-                            print('inserting ' + str(len(games_db)) + ' games')
-                            # insert query
-                            cur.executemany(insert_sql, games_db)
-                            conn.commit()
-
-                    print(str(index) + '/' + str(len(teams)) + ' teams')
-                    index += 1
+                cur.execute('SELECT gameId FROM games')
+                saved_games = set(game[0] for game in cur.fetchall())
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
-        
-def insertGoalerGameLogs(start_season, end_season):
-    client = NHLClient()
+        return
+
+    def fetch(unit):
+        _, season, _ = unit
+        # Skip games already saved
+        return [game.values() for game in get_season_games(season) if game.gameId not in saved_games]
+
+    def save(conn, games_db):
+        bulk_upsert(conn, 'games', GAME_COLUMNS, ('gameId',), games_db, False)
+
+    # The league schedule is loaded once per season, not once per team
+    units = [('league', str(i) + str(i + 1), 0) for i in range(start_season, end_season)]
+    run_backfill('games', units, fetch, save, workers)
+
+def goaler_game_log_row(playerId, game_log, game_type):
+    return (
+        game_log['gameId'],
+        playerId,
+        game_log['teamAbbrev'],
+        game_log['homeRoadFlag'],
+        game_log['gameDate'],
+        game_log['goals'],
+        game_log['assists'],
+        game_log['gamesStarted'],
+        game_log['decision'] if 'decision' in game_log else '',
+        game_log['shotsAgainst'],
+        game_log['goalsAgainst'],
+        game_log['savePctg'] if 'savePctg' in game_log else 0,
+        game_log['shutouts'],
+        game_log['opponentAbbrev'],
+        game_log['pim'],
+        game_log['toi'],
+        game_type
+    )
+
+def insertGoalerGameLogs(start_season, end_season, workers = BACKFILL_WORKERS):
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
-                select_sql = 'SELECT playerId from goalers'
-                cur.execute(select_sql)
+                cur.execute('SELECT playerId from goalers')
                 goalers = cur.fetchall()
-                index = 0
-                for goaler in goalers:
-                    for i in range(start_season, end_season):
-                        insert_sql = ''' INSERT INTO goalerGamelogs(     
-                                            gameLogsId,                           
-                                            gameId,
-                                            playerId,
-                                            teamAbbrev,
-                                            homeRoadFlag,
-                                            gameDate,
-                                            goals,
-                                            assists,
-                                            gamesStarted,
-                                            decision,
-                                            shotsAgainst,
-                                            goalsAgainst,
-                                            savePctg,
-                                            shutouts,
-                                            opponentAbbrev,
-                                            pim,
-                                            toi,
-                                            gameType
-                                        ) values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) 
-                                        RETURNING *
-                                    '''
-                        season = str(i) + str(i + 1)
-                        game_logs_db = []
-
-                        for game_type in range(1,4):
-                            try:
-                                game_logs = client.stats.player_game_log(player_id=goaler[0], season_id=season, game_type=game_type)
-                                for game_log in game_logs:
-                                    # Check if player already exists
-                                    sql = 'SELECT 1 FROM goalerGamelogs WHERE playerId = %s AND gameId = %s'
-                                    cur.execute(sql, (str(goaler[0]), str(game_log['gameId'])))
-                                    if(cur.fetchone() is None):
-                                        game_logs_db.append((
-                                            game_log['gameId'] + goaler[0],
-                                            game_log['gameId'],
-                                            goaler[0],
-                                            game_log['teamAbbrev'],
-                                            game_log['homeRoadFlag'],
-                                            game_log['gameDate'],
-                                            game_log['goals'],
-                                            game_log['assists'],
-                                            game_log['gamesStarted'],
-                                            game_log['decision'] if 'decision' in game_log else '',
-                                            game_log['shotsAgainst'],
-                                            game_log['goalsAgainst'],
-                                            game_log['savePctg'] if 'savePctg' in game_log else 0,
-                                            game_log['shutouts'],
-                                            game_log['opponentAbbrev'],
-                                            game_log['pim'],
-                                            game_log['toi'],
-                                            game_type
-                                        ))
-                            except(KeyError) as error:
-                                yes = True
-                                print('Cannot get game logs for goaler ' + goaler[0])
-                                traceback.print_exc()
-                        
-                        if(len(game_logs_db) > 0):
-                            print('inserting ' + str(len(game_logs_db)) + ' gameLogs')
-                            # insert query
-                            cur.executemany(insert_sql, game_logs_db)
-                            conn.commit()
-
-                    print(str(index) + '/' + str(len(goalers)) + ' players')
-                    index += 1
+                cur.execute('SELECT playerId, gameId FROM goalerGameLogs')
+                saved_game_logs = set(cur.fetchall())
     except (psycopg2.DatabaseError, Exception) as error:
         traceback.print_exc()
+        return
+
+    def fetch(unit):
+        playerId, season, game_type = unit
+        try:
+            game_logs = client.stats.player_game_log(player_id=playerId, season_id=season, game_type=game_type)
+        except(KeyError) as error:
+            print('Cannot get game logs for goaler ' + str(playerId))
+            traceback.print_exc()
+            return []
+        # Skip game logs already saved
+        return [goaler_game_log_row(playerId, game_log, game_type) for game_log in game_logs if (playerId, game_log['gameId']) not in saved_game_logs]
+
+    def save(conn, game_logs_db):
+        bulk_upsert(conn, 'goalerGameLogs', GOALER_GAMELOG_COLUMNS, ('gameId', 'playerId'), game_logs_db, False)
+
+    units = [(goaler[0], str(i) + str(i + 1), game_type) for goaler in goalers for i in range(start_season, end_season) for game_type in range(1,4)]
+    run_backfill('goalerGameLogs', units, fetch, save, workers)
    
+def insertBoxscoreGameLogs(start_season, end_season, workers = BACKFILL_WORKERS):
+    # Gamelogs game by game from the boxscores of the stored games: two requests per game
+    # instead of three per player and season, and players missing from the database get bootstrapped.
+    seasons = tuple(str(i) + str(i + 1) for i in range(start_season, end_season))
+    try:
+        with unit_of_work() as conn:
+            with conn.cursor() as cur:
+                # Skip games not played yet and games whose gamelogs are already saved
+                cur.execute(
+                    'SELECT ' + ', '.join(GAME_COLUMNS) + ' FROM games WHERE season IN %s AND gameOutcome IS DISTINCT FROM %s '
+                    'AND NOT EXISTS (SELECT 1 FROM gamelogs WHERE gamelogs.gameId = games.gameId)',
+                    (seasons, 'FUT'))
+                games = {row[0]: Game(*row) for row in cur.fetchall()}
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        return
+
+    def fetch(unit):
+        game = games[unit[0]]
+        boxScore = client.game_center.boxscore(game.gameId)
+        landing = client.game_center.landing(game.gameId)
+        # The games table only keeps the day, the parsers want the start time like in the schedule
+        game.startTimeUTC = boxScore['startTimeUTC']
+        game.gameType = int(game.gameType)
+        gameLogs, goalerLogs = fetch_game_logs(game, boxScore, landing)
+        return gameLogs + goalerLogs
+
+    def save(conn, game_logs):
+        bulk_upsert(conn, 'gamelogs', PLAYER_GAMELOG_COLUMNS, ('gameId', 'playerId'), [log.values() for log in game_logs if isinstance(log, PlayerGameLog)], False)
+        bulk_upsert(conn, 'goalerGameLogs', GOALER_GAMELOG_COLUMNS, ('gameId', 'playerId'), [log.values() for log in game_logs if isinstance(log, GoalerGameLog)], False)
+
+    units = [(game.gameId, str(game.season), int(game.gameType)) for game in games.values()]
+    run_backfill('boxscoreGameLogs', units, fetch, save, workers)
+
 def insertPlayersHeadhots():
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
                 sql = 'SELECT playerId, teamAbbrev FROM players WHERE gamesPlayed > 0'
                 cur.execute(sql)
                 players = cur.fetchall()
                 for player in players:
-                    updatesql = 'UPDATE players set headshot = \'https://assets.nhle.com/mugs/nhl/20232024/' + player[1] + '/' + player[0] + '.png\''+ ' WHERE playerId = \'' + player[0] + '\''
+                    updatesql = 'UPDATE players set headshot = \'https://assets.nhle.com/mugs/nhl/20232024/' + player[1] + '/' + str(player[0]) + '.png\''+ ' WHERE playerId = ' + str(player[0])
                     cur.execute(updatesql)
-                conn.commit()
     except (psycopg2.DatabaseError, Exception) as error:
         print(error)
 
 def insertteamsLogo():
     try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
+        with unit_of_work() as conn:
             with conn.cursor() as cur:
                 sql = 'SELECT abbrev FROM teams'
                 cur.execute(sql)
@@ -668,51 +553,9 @@ def insertteamsLogo():
                 for team in teams:
                     updatesql = 'UPDATE teams set logo = \'https://assets.nhle.com/logos/nhl/svg/' + team[0] + '_light.svg\'' + ' WHERE abbrev = \'' + team[0] + '\''
                     cur.execute(updatesql)
-                conn.commit()
     except (psycopg2.DatabaseError, Exception) as error:
         print(error)
 
-def updatePlayersAdditionalInfos():
-    try:
-        with psycopg2.connect(database=os.environ.get("DATABASE_URL", 'nhl-stats-fetcher'), 
-                              user=os.environ.get('DATABASE_USERNAME', 'py-user'), 
-                              password=os.environ.get('DATABASE_PASWORD'), 
-                              host=os.environ.get('DATABASE_URL', '127.0.0.1'), 
-                              port= os.environ.get('DATABASE_PORT', '5433')) as conn:
-            with conn.cursor() as cur:
-                sql = 'SELECT playerId FROM players where gamesPlayed > 0'
-                cur.execute(sql)
-                players = cur.fetchall()
-                today = datetime.today()
-                i = 1
-                for player in players:
-                    print(str(i) + '/' + str(len(players)))
-                    i += 1                    
-                    url = 'https://api-web.nhle.com/v1/player/' + player[0] + '/landing'
-                    response = requests.get(url)
-
-                    if response.status_code == 200:
-                        result = response.json()
-                        birthDate = datetime.strptime(result['birthDate'], "%Y-%m-%d")
-                        age = today.year - birthDate.year - ((today.month, today.day) < (birthDate.month, birthDate.day))
-                        height = result['heightInInches']
-                        weight = result['weightInPounds']
-                        birthCountry = result['birthCountry']
-                        updatesql = '''
-                            UPDATE players
-                            SET age = %s,
-                                height = %s,
-                                weight = %s,
-                                birthCountry = %s
-                            WHERE playerId = %s
-                        '''
-                        cur.execute(updatesql, (str(age), str(height), str(weight), birthCountry, str(player[0])))
-                    else:
-                        print("Failed to retrieve data. Status code:", response.status_code)
-                conn.commit()
-    except (psycopg2.DatabaseError, Exception) as error:
-        traceback.print_exc()
-
 def initPools():
     createPoolTable()
     
@@ -731,15 +574,50 @@ def initPools():
     
     insertPools(pools)
 
+def initStandings():
+    # First build of the pool standings rollups, updates then only refresh the days they touch.
+    createStandingsTable()
+    try:
+        with unit_of_work() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT gameDate FROM gamelogs UNION SELECT gameDate FROM goalerGameLogs')
+                gameDates = [row[0] for row in cur.fetchall() if row[0] is not None]
+    except (psycopg2.DatabaseError, Exception) as error:
+        traceback.print_exc()
+        return
+    refresh_standings(gameDates)
+
+STEPS = {
+    'schema': lambda args: (generate_db(), migrate()),
+    'migrate': lambda args: migrate(),
+    'teams': lambda args: insertTeams(),
+    'players': lambda args: insertPlayers(args.start_season, args.end_season),
+    'goalers': lambda args: insertGoalers(args.start_season, args.end_season),
+    'games': lambda args: insertGames(args.start_season, args.end_season, args.workers),
+    'gamelogs': lambda args: insertGameLogs(args.start_season, args.end_season, args.workers),
+    'goalergamelogs': lambda args: insertGoalerGameLogs(args.start_season, args.end_season, args.workers),
+    'boxscoregamelogs': lambda args: insertBoxscoreGameLogs(args.start_season, args.end_season, args.workers),
+    'headshots': lambda args: insertPlayersHeadhots(),
+    'logos': lambda args: insertteamsLogo(),
+    'bios': lambda args: (refresh_bios('players', args.workers), refresh_bios('goalers', args.workers)),
+    'pools': lambda args: initPools(),
+    'standings': lambda args: initStandings(),
+}
+
 if __name__ == '__main__':
-    #generate_db()
-    #insertTeams()
-    #insertPlayers(datetime.now().year - 10, datetime.now().year)
-    #insertGoalers(datetime.now().year - 10, datetime.now().year)
-    #insertGames(datetime.now().year - 2, datetime.now().year)
-    #insertGameLogs(datetime.now().year - 2, datetime.now().year)
-    #insertGoalerGameLogs(datetime.now().year - 2, datetime.now().year)
-    #insertPlayersHeadhots()
-    #insertteamsLogo()
-    #updatePlayersAdditionalInfos()
-    initPools()
\ No newline at end of file
+    # e.g. python init-db.py games gamelogs goalergamelogs --start-season 2022
+    #      python init-db.py games boxscoregamelogs --start-season 2022 (a request per game instead of per player)
+    # Backfills checkpoint every unit of work, rerun the same command to resume after a crash.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('steps', nargs='*', default=['pools'], help=', '.join(STEPS))
+    parser.add_argument('--start-season', type=int, default=datetime.now().year - 2)
+    parser.add_argument('--end-season', type=int, default=datetime.now().year)
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    args = parser.parse_args()
+    for step in args.steps:
+        if step not in STEPS:
+            parser.error('unknown step ' + step)
+
+    for step in args.steps:
+        STEPS[step](args)
+    print('API requests: ' + governor.summary())
@@ -0,0 +1,87 @@
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from controllers.api import client, governor
+from controllers.replay import FIXTURES_DIR, FixtureStore
+from controllers.game import FETCH_WORKERS, get_season_games, get_week_games, fetch_games_payloads
+from controllers.player import bootstrap_players
+from controllers.goaler import bootstrap_goalers
+from controllers.bio import fetch_bio
+
+# Records the NHL API responses the update and backfill paths ask for, for stub-server.py to replay.
+# Requests are made in the same order and batches as the real code on an empty database.
+# e.g. python record-fixtures.py --week 2024-01-15 --season 20232024 --gamelogs --max-players 50
+
+
+def record_week(date):
+    games = [game for game in get_week_games(datetime.strptime(date, '%Y-%m-%d')) if game.gameOutcome != 'FUT']
+    print('Recording ' + str(len(games)) + ' games of the week of ' + date)
+    playerIds = set()
+    for game, boxScore, landing in fetch_games_payloads(games):
+        gameDate = datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ')
+        for team in ('awayTeam', 'homeTeam'):
+            stats = boxScore['playerByGameStats'][team]
+            for group in ('forwards', 'defense'):
+                ids = [player['playerId'] for player in stats[group]]
+                bootstrap_players([playerId for playerId in ids if playerId not in playerIds], gameDate, game.gameType)
+                playerIds.update(ids)
+            ids = [goalie['playerId'] for goalie in stats['goalies'] if goalie['toi'] != '00:00']
+            bootstrap_goalers([playerId for playerId in ids if playerId not in playerIds], gameDate, game.gameType)
+            playerIds.update(ids)
+    return playerIds
+
+
+def record_season(season, maxPlayers):
+    print('Recording season ' + season)
+    get_season_games(season)
+    skaters = client.stats.skater_stats_summary_simple(start_season=season, end_season=season, limit=-1)
+    goalies = client.stats.goalie_stats_summary_simple(start_season=season, end_season=season, limit=-1)
+    return [row['playerId'] for row in skaters][:maxPlayers] + [row['playerId'] for row in goalies][:maxPlayers]
+
+
+def record_gamelogs(playerIds, seasons, workers):
+    # init-db.py gamelogs asks every stored player for every season and game type
+    units = [(playerId, season, gameType) for playerId in playerIds for season in seasons for gameType in range(1, 4)]
+    print('Recording ' + str(len(units)) + ' player game logs')
+
+    def fetch(unit):
+        try:
+            client.stats.player_game_log(player_id=unit[0], season_id=unit[1], game_type=unit[2])
+        except KeyError:
+            pass
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(fetch, units))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--week', action='append', default=[], help='YYYY-MM-DD, the week starting that day')
+    parser.add_argument('--season', action='append', default=[], help='e.g. 20232024')
+    parser.add_argument('--gamelogs', action='store_true', help="also record the seasons' player game logs")
+    parser.add_argument('--bios', action='store_true', help="also record the landing page of the weeks' players")
+    parser.add_argument('--max-players', type=int, default=-1, help='skaters and goalies per season to record game logs for, -1 for all')
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS)
+    args = parser.parse_args()
+
+    client._http_client.recorder = FixtureStore(args.fixtures)
+    maxPlayers = None if args.max_players < 0 else args.max_players
+
+    weekPlayers = set()
+    for week in args.week:
+        weekPlayers.update(record_week(week))
+
+    seasonPlayers = []
+    for season in args.season:
+        seasonPlayers += record_season(season, maxPlayers)
+
+    if args.gamelogs:
+        record_gamelogs(sorted(set(seasonPlayers)), args.season, args.workers)
+
+    if args.bios:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(fetch_bio, sorted(weekPlayers)))
+
+    print(str(len(client._http_client.recorder)) + ' fixtures in ' + args.fixtures)
+    print('API requests: ' + governor.summary())
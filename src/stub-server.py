@@ -0,0 +1,159 @@
+import json
+import httpx
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from controllers.replay import FIXTURES_DIR, FixtureStore, original_url
+
+# Serves recorded fixtures in place of the NHL hosts, with injected latency and failures.
+# e.g. python stub-server.py --latency 0.05 --error-rate 0.02
+#      API_REPLAY_URL=http://127.0.0.1:8765 HTTP_CACHE_DIR= python update-games-stats.py
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/__stats':
+            with server.lock:
+                stats = dict(server.stats)
+            self.send_json(200, stats)
+            return
+
+        server.count('requests')
+        delay = max(0.0, random.gauss(server.latency, server.jitter)) if server.latency > 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+        roll = random.random()
+        if roll < server.dropRate:
+            # The client sees a connection reset
+            server.count('dropped')
+            self.close_connection = True
+            self.connection.close()
+            return
+        roll -= server.dropRate
+        if roll < server.throttleRate:
+            server.count('throttled')
+            self.send_json(429, {'message': 'Too Many Requests'}, {'Retry-After': str(server.retryAfter)})
+            return
+        roll -= server.throttleRate
+        if roll < server.errorRate:
+            server.count('errors')
+            self.send_json(503, {'message': 'Service Unavailable'})
+            return
+
+        fixture = server.fixtures.load(original_url(self.path))
+        if fixture is None:
+            server.count('missing')
+            print('No fixture for ' + original_url(self.path))
+            self.send_json(404, {'message': 'No fixture'})
+            return
+        server.count('served')
+        self.send_json(fixture['status'], fixture['body'])
+
+    def send_json(self, status, body, headers = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency = 0, jitter = 0, errorRate = 0, throttleRate = 0, dropRate = 0, retryAfter = 1, verbose = False):
+        super().__init__(address, StubHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.throttleRate = throttleRate
+        self.dropRate = dropRate
+        self.retryAfter = retryAfter
+        self.verbose = verbose
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+def round_trip_check():
+    # Records one skater summary call made through the real client, replays it through a
+    # stub server and checks the same data comes back. Nothing leaves the machine.
+    import controllers.api as api
+    httpClient = api.client._http_client
+    body = {'data': [{'playerId': 8478402, 'seasonId': 20232024, 'skaterFullName': 'Connor McDavid'}], 'total': 1}
+    fixtures = FixtureStore(tempfile.mkdtemp(prefix='nhl-fixtures-'))
+    server = StubServer(('127.0.0.1', 0), fixtures)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def summary():
+        return api.client.stats.skater_stats_summary_simple(start_season='20232024', end_season='20232024', limit=-1, default_cayenne_exp='playerId in (8478402)')
+
+    cache, recorder, fetch = httpClient.cache, httpClient.recorder, httpClient.fetch
+    try:
+        httpClient.cache = None
+        # Made up response, but the request nhlpy builds is recorded as is
+        httpClient.recorder = fixtures
+        httpClient.fetch = lambda url, params=None: httpx.Response(200, json=body, request=httpx.Request('GET', url, params=params))
+        summary()
+
+        httpClient.recorder = None
+        httpClient.fetch = fetch
+        api.API_REPLAY_URL = 'http://127.0.0.1:' + str(server.server_address[1])
+        try:
+            replayed = summary()
+        except KeyError:
+            # A 404 body has no data
+            replayed = None
+    finally:
+        httpClient.cache, httpClient.recorder, httpClient.fetch = cache, recorder, fetch
+        server.shutdown()
+
+    ok = replayed == body['data'] and server.stats['served'] == 1 and server.stats['missing'] == 0
+    print('Round trip ' + ('ok' if ok else 'failed') + ': ' + json.dumps(dict(server.stats)))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='mean seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of requests answered with a 429')
+    parser.add_argument('--drop-rate', type=float, default=0, help='share of connections closed without a response')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--check', action='store_true', help='record and replay one stats call, then exit')
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if round_trip_check() else 1)
+
+    fixtures = FixtureStore(args.fixtures)
+    server = StubServer((args.host, args.port), fixtures, args.latency, args.jitter, args.error_rate, args.throttle_rate, args.drop_rate, args.retry_after, args.verbose)
+    print('Serving ' + str(len(fixtures)) + ' fixtures on http://' + args.host + ':' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print('Stub server stats: ' + json.dumps(dict(server.stats)))
@@ -1,58 +1,274 @@
 import os
+import time
 import psycopg2
+import argparse
 import traceback
-from nhlpy import NHLClient
 from datetime import datetime, timedelta
-from controllers.game import Game, get_season_games, save_games_to_db, get_week_games
-from controllers.player import Player, PlayerGameLog, fetch_player_log, save_player_gamelogs_to_db
-from controllers.goaler import Goaler, GoalerGameLog, fetch_goaler_log, save_goaler_gamelogs_to_db
-client = NHLClient()
+from controllers.game import Game, get_season_games, save_games_to_db, get_week_games, fetch_games_payloads, createGameSyncTable, get_games_to_sync, save_games_sync_state, NOT_STARTED_STATES, UNPLAYABLE_SCHEDULE_STATES
+from controllers.player import Player, PlayerGameLog, save_player_gamelogs_to_db
+from controllers.goaler import Goaler, GoalerGameLog, save_goaler_gamelogs_to_db
+from controllers.boxscore import fetch_game_logs
+from controllers.standings import createStandingsTable, refresh_standings
+from controllers.schema import migrate
+from controllers.bio import refresh_ages
+from controllers.api import governor, FINAL_GAME_STATES
+from controllers.metrics import metrics
+
+GAMELOG_BATCH_SIZE = int(os.environ.get("GAMELOG_BATCH_SIZE", "1000"))
+# Seconds between two polls of a live game, shortest right after a change, longest during intermissions
+LIVE_POLL_MIN = float(os.environ.get("LIVE_POLL_MIN", "15"))
+LIVE_POLL_MAX = float(os.environ.get("LIVE_POLL_MAX", "120"))
+# Seconds between two reads of today's schedule
+LIVE_SCHEDULE_REFRESH = float(os.environ.get("LIVE_SCHEDULE_REFRESH", "600"))
+# Seconds past its start time after which a game that has not started is no longer watched
+LIVE_START_DEADLINE = float(os.environ.get("LIVE_START_DEADLINE", "10800"))
 
 def updateSeasonGames():
     games = get_season_games()
     save_games_to_db(games)
 
-def updateWeeklyStats():
-    # 1. Get the stats from the last week.
-    startDate = datetime.now() - timedelta(days=6)
-    
+def parse_game_logs(games):
+    # Yields each game's logs as soon as its payloads are fetched.
+    i = 0
+    for game, boxScore, landing in fetch_games_payloads(games):
+        print('Processing ' + str(i) + '/' + str(len(games)) + ' games ' + str(game.gameId))
+        with metrics.span('parse'):
+            gameLogs, goalerLogs = fetch_game_logs(game, boxScore, landing)
+        i += 1
+        yield game, boxScore, gameLogs, goalerLogs
+
+def save_game_logs(gamelogs, goalerlogs):
+    # The goaler logs are written even when the player logs fail
+    playersSaved = save_player_gamelogs_to_db(gamelogs)
+    goalersSaved = save_goaler_gamelogs_to_db(goalerlogs)
+    return playersSaved and goalersSaved
+
+def write_game_logs(parsedGames, batchSize = GAMELOG_BATCH_SIZE):
+    # Buffers logs and writes them at the first game boundary past batchSize rows, then yields
+    # (game, boxScore, written) for every game of the batch, written is False when a write failed.
+    batch = []
     gamelogs = []
     goalerlogs = []
+    for game, boxScore, gameLogs, goalerLogs in parsedGames:
+        batch.append((game, boxScore))
+        gamelogs += gameLogs
+        goalerlogs += goalerLogs
+
+        if len(gamelogs) + len(goalerlogs) >= batchSize:
+            written = save_game_logs(gamelogs, goalerlogs)
+            for game, boxScore in batch:
+                yield game, boxScore, written
+            batch, gamelogs, goalerlogs = [], [], []
+
+    if batch:
+        written = save_game_logs(gamelogs, goalerlogs)
+        for game, boxScore in batch:
+            yield game, boxScore, written
+
+def updateWeeklyStats(startDate = None):
+    # 1. Get the stats from the last week, or from the week starting at startDate.
+    if startDate is None:
+        startDate = datetime.now() - timedelta(days=6)
     
     games = get_week_games(startDate)
     print ('Got ' + str(len(games)) + ' games to get gamelogs from')
-    i = 0
-    for game in games:
-        print('Processing ' + str(i) + '/' + str(len(games)) + ' games ' + str(game.gameId))
-        # Game is not started, no gamelogs
-        if game.gameOutcome != "FUT":
-            boxScore = client.game_center.boxscore(game.gameId)
-            gameGoals = client.game_center.landing(game.gameId)["summary"]["scoring"]
-
-            # Away team
-            # Forwards
-            gamelogs += fetch_player_log(boxScore["playerByGameStats"]["awayTeam"]["forwards"], game, gameGoals, True)
-            # defense
-            gamelogs += fetch_player_log(boxScore["playerByGameStats"]["awayTeam"]["defense"], game, gameGoals, True)
-            # goalies
-            goalerlogs += fetch_goaler_log(boxScore["playerByGameStats"]["awayTeam"]["goalies"], game, gameGoals, True)
-            
-            # Home team
-            # Forwards
-            gamelogs += fetch_player_log(boxScore["playerByGameStats"]["homeTeam"]["forwards"], game, gameGoals, False)
-            # defense
-            gamelogs += fetch_player_log(boxScore["playerByGameStats"]["homeTeam"]["defense"], game, gameGoals, False)
-            # goalies
-            goalerlogs += fetch_goaler_log(boxScore["playerByGameStats"]["homeTeam"]["goalies"], game, gameGoals, False)
+    # Game is not started, no gamelogs
+    startedGames = [game for game in games if game.gameOutcome != "FUT"]
 
-        i += 1
-    
-    print('Got: ' + str(len(gamelogs)) + ' gamelogs')
-    save_player_gamelogs_to_db(gamelogs)
-    print('Got: ' + str(len(goalerlogs)) + 'goaler gamelogs')
-    save_goaler_gamelogs_to_db(goalerlogs)
+    # 2. Fetch, parse and save as a stream
+    gameDates = []
+    failed = 0
+    for game, boxScore, written in write_game_logs(parse_game_logs(startedGames)):
+        if not written:
+            failed += 1
+            continue
+        gameDates.append(game.startTimeUTC)
+    print('Saved gamelogs of ' + str(len(gameDates)) + ' games, ' + str(failed) + ' failed')
+
+    # 3. Roll the touched days up into the pool standings
+    createStandingsTable()
+    refresh_standings(gameDates)
+
+def updateIncrementalStats():
+    # Only fetches games that are live or not yet stored as final.
+    createGameSyncTable()
+    startDate = datetime.now() - timedelta(days=6)
+
+    games = get_games_to_sync(get_week_games(startDate))
+    print ('Got ' + str(len(games)) + ' games to sync')
+
+    # Keep scores of the synced games current, goaler gamelogs reference them
+    save_games_to_db(games)
+
+    gameStates = []
+    gameDates = []
+    for game, boxScore, written in write_game_logs(parse_game_logs(games)):
+        # Games whose write failed stay out of the sync state and get fetched again
+        if not written:
+            continue
+        gameStates.append((game.gameId, boxScore["gameState"]))
+        gameDates.append(game.startTimeUTC)
+    save_games_sync_state(gameStates)
+
+    createStandingsTable()
+    refresh_standings(gameDates)
+
+class LiveGame:
+    def __init__(self, game):
+        self.game = game
+        self.nextPoll = max(time.time(), start_time(game))
+        self.interval = LIVE_POLL_MIN
+        self.rows = {} # (table, playerId) -> gamelog values at the last poll
+
+    def changed_logs(self, logs, table):
+        # Logs whose counters moved since the last successful write
+        return [log for log in logs if self.rows.get((table, log.playerId)) != log.values()]
+
+    def remember(self, logs, table):
+        # Only once they are in the database, so a failed write is retried on the next poll
+        for log in logs:
+            self.rows[(table, log.playerId)] = log.values()
+
+    def plan_next_poll(self, boxScore, changed):
+        # Poll fast while the game moves, back off while it doesn't
+        if boxScore['gameState'] in NOT_STARTED_STATES:
+            self.interval = LIVE_POLL_MAX
+        elif changed or boxScore['gameState'] == 'CRIT':
+            self.interval = LIVE_POLL_MIN
+        elif boxScore.get('clock', {}).get('inIntermission'):
+            self.interval = LIVE_POLL_MAX
+        else:
+            self.interval = min(LIVE_POLL_MAX, self.interval * 1.5)
+        self.nextPoll = time.time() + self.interval
+
+
+def start_time(game):
+    return (datetime.strptime(game.startTimeUTC, '%Y-%m-%dT%H:%M:%SZ') - datetime(1970, 1, 1)).total_seconds()
+
+
+def get_todays_games():
+    # Games starting within the next day or started in the last 12 hours
+    now = time.time()
+    games = get_week_games(datetime.utcnow() - timedelta(hours=12))
+    return [game for game in games if now - 12 * 3600 <= start_time(game) <= now + 24 * 3600]
+
+
+def poll_live_game(liveGame, boxScore, landing):
+    # Upserts the rows that changed since the last poll, returns True when anything did.
+    # Raises when a write fails, the game is then polled again instead of being marked final.
+    game = liveGame.game
+    if boxScore['gameState'] in NOT_STARTED_STATES:
+        return False
+
+    changed = False
+    awayScore = boxScore['awayTeam'].get('score')
+    homeScore = boxScore['homeTeam'].get('score')
+    if (awayScore, homeScore) != (game.awayTeamScore, game.homeTeamScore):
+        scoredGame = Game(*game.values())
+        scoredGame.awayTeamScore = awayScore
+        scoredGame.homeTeamScore = homeScore
+        scoredGame.gameOutcome = boxScore.get('gameOutcome', {}).get('lastPeriodType')
+        if not save_games_to_db([scoredGame]):
+            raise RuntimeError('Cannot save the score of game ' + str(game.gameId))
+        liveGame.game = game = scoredGame
+        changed = True
+
+    with metrics.span('parse'):
+        gameLogs, goalerLogs = fetch_game_logs(game, boxScore, landing)
+    gameLogs = liveGame.changed_logs(gameLogs, 'gamelogs')
+    goalerLogs = liveGame.changed_logs(goalerLogs, 'goalerGameLogs')
+    if gameLogs:
+        if not save_player_gamelogs_to_db(gameLogs):
+            raise RuntimeError('Cannot save the gamelogs of game ' + str(game.gameId))
+        liveGame.remember(gameLogs, 'gamelogs')
+    if goalerLogs:
+        if not save_goaler_gamelogs_to_db(goalerLogs):
+            raise RuntimeError('Cannot save the goaler gamelogs of game ' + str(game.gameId))
+        liveGame.remember(goalerLogs, 'goalerGameLogs')
+    return changed or len(gameLogs) > 0 or len(goalerLogs) > 0
+
+
+def updateLiveStats():
+    # Watches today's games until they are all final, postponed or cancelled. Live games are polled on an
+    # adaptive interval and only their changed gamelogs are written, then the day's standings are refreshed.
+    createGameSyncTable()
+    createStandingsTable()
+    watched = {}
+    finished = set()
+    nextSchedule = 0
+
+    while True:
+        if time.time() >= nextSchedule:
+            for game in get_todays_games():
+                if game.gameId not in watched and game.gameId not in finished:
+                    watched[game.gameId] = LiveGame(game)
+            nextSchedule = time.time() + LIVE_SCHEDULE_REFRESH
+            print('Watching ' + str(len(watched)) + ' games')
+
+        if len(watched) == 0:
+            print('No game left to watch today')
+            return
+
+        due = [liveGame.game for liveGame in watched.values() if liveGame.nextPoll <= time.time()]
+        # A failed fetch is retried after the game's current interval
+        for game in due:
+            watched[game.gameId].nextPoll = time.time() + watched[game.gameId].interval
+        changedDates = set()
+        for game, boxScore, landing in fetch_games_payloads(due):
+            liveGame = watched[game.gameId]
+            try:
+                changed = poll_live_game(liveGame, boxScore, landing)
+            except Exception as error:
+                print('Cannot poll game ' + str(game.gameId))
+                traceback.print_exc()
+                metrics.error('parse', error)
+                # Polled again after its current interval, even if the boxscore says final
+                continue
+            if changed:
+                changedDates.add(game.startTimeUTC)
+
+            if boxScore['gameState'] in FINAL_GAME_STATES:
+                print('Game ' + str(game.gameId) + ' is final')
+                save_games_sync_state([(game.gameId, boxScore['gameState'])])
+            elif boxScore.get('gameScheduleState') in UNPLAYABLE_SCHEDULE_STATES:
+                print('Game ' + str(game.gameId) + ' is ' + boxScore['gameScheduleState'] + ', not watching it anymore')
+            elif boxScore['gameState'] in NOT_STARTED_STATES and time.time() > start_time(game) + LIVE_START_DEADLINE:
+                print('Game ' + str(game.gameId) + ' has not started ' + str(int(LIVE_START_DEADLINE / 60)) + ' minutes after its start time, not watching it anymore')
+            else:
+                liveGame.plan_next_poll(boxScore, changed)
+                continue
+            finished.add(game.gameId)
+            del watched[game.gameId]
+
+        if changedDates:
+            refresh_standings(changedDates)
+
+        if len(watched) > 0:
+            nextPoll = min(min(liveGame.nextPoll for liveGame in watched.values()), nextSchedule)
+            time.sleep(max(1.0, nextPoll - time.time()))
 
 
 if __name__ == '__main__':
-    updateSeasonGames()
-    updateWeeklyStats()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true', help='only sync live games and games not stored as final yet')
+    parser.add_argument('--live', action='store_true', help="poll today's games until they are all final")
+    args = parser.parse_args()
+
+    job = 'live' if args.live else 'incremental' if args.incremental else 'weekly'
+    metrics.log('start', job=job)
+    try:
+        migrate()
+        refresh_ages()
+        if args.live:
+            updateLiveStats()
+        elif args.incremental:
+            updateIncrementalStats()
+        else:
+            updateSeasonGames()
+            updateWeeklyStats()
+    except Exception as error:
+        metrics.error(job, error)
+        raise
+    finally:
+        print('API requests: ' + governor.summary())
+        metrics.finish(job)